@@ -1,23 +1,36 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort, g
+from markupsafe import Markup
 import firebase_admin
-from firebase_admin import credentials, firestore, auth
+from firebase_admin import credentials, firestore, auth, storage
 import os
 from functools import wraps
 import requests
-from datetime import datetime
+from datetime import datetime, timezone
 import json
+import base64
+import hashlib
 import logging
-from google.cloud import storage
+from logging_setup import configure_logging
+import time
+import threading
+import asyncio
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core import exceptions as google_exceptions
+from google.cloud.firestore_v1.field_path import FieldPath
+from search_index import RecipeSearchIndex
+from facet_index import RecipeFacetIndex
+from cache_invalidation import fetch_invalidations, publish_recipe_invalidations, publish_user_invalidations
+from spoonacular_cache import ResponseCache
+from job_runner import JobRunner
+from recipe_cards import RECIPE_CARD_FIELDS, build_recipe_card, recipe_card_ref
+from token_verifier import FirebaseTokenVerifier
+import metrics
+import firestore_profiler
 
 # Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
+configure_logging("app.log")
 logger = logging.getLogger("app")
 
 app = Flask(__name__)
@@ -32,6 +45,331 @@ except ValueError:
 
 db = firestore.client()
 
+# Bucket holding uploaded recipe, review and profile photos
+STORAGE_BUCKET = os.environ.get('FIREBASE_STORAGE_BUCKET', 'recipehub-36272.firebasestorage.app')
+
+# ID tokens are verified locally against a cached copy of Firebase's signing keys
+token_verifier = FirebaseTokenVerifier(firebase_admin.get_app().project_id)
+
+# Thread pool for running independent Firestore lookups within a request
+lookup_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('LOOKUP_WORKERS', 8)))
+
+def submit_lookup(func, *args):
+    """Run a lookup on the pool in a copy of the current context, so its Firestore calls count toward this request"""
+    return lookup_executor.submit(contextvars.copy_context().run, func, *args)
+
+async def gather_lookups(*lookups):
+    """Run blocking Firestore lookups concurrently from an async view, returning their results in order"""
+    return await asyncio.gather(*(asyncio.wrap_future(submit_lookup(lookup)) for lookup in lookups))
+
+# In-process cache with LRU and TTL eviction
+class LRUCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0
+            }
+
+# Recipes rarely change after import, so recipe documents are read through a shared cache
+recipe_cache = LRUCache(max_size=int(os.environ.get('RECIPE_CACHE_SIZE', 2048)),
+                        ttl=int(os.environ.get('RECIPE_CACHE_TTL', 600)))
+
+# Recipe cards (the fields listing pages render), kept apart so listings never load full recipes
+recipe_card_cache = LRUCache(max_size=int(os.environ.get('RECIPE_CARD_CACHE_SIZE', 8192)),
+                             ttl=int(os.environ.get('RECIPE_CACHE_TTL', 600)))
+
+# Card fields plus the timestamps listing ETags are built from
+RECIPE_LISTING_FIELDS = RECIPE_CARD_FIELDS + ['importedAt', 'updatedAt']
+
+# Short-lived cache for listing query results (e.g. the featured recipe IDs)
+listing_cache = LRUCache(max_size=16, ttl=60)
+
+# Recipe versions used for ETags; kept briefly so other workers' writes show up quickly
+recipe_version_cache = LRUCache(max_size=4096, ttl=10)
+RECIPE_VERSION_FIELDS = ['importedAt', 'updatedAt', 'rating_count', 'rating_sum']
+
+# Rendered HTML fragments keyed by the version of the data they were rendered from
+fragment_cache = LRUCache(max_size=512, ttl=3600)
+
+# User profiles (display names) copied into reviews; evicted by update_profile
+user_profile_cache = LRUCache(max_size=4096, ttl=300)
+
+# Long admin operations run in the background and are polled via /api/jobs/<id>
+job_runner = JobRunner(db, max_workers=int(os.environ.get('JOB_WORKERS', 2)))
+
+# Jobs started by users' own actions get their own workers so they never queue behind admin work
+user_job_runner = JobRunner(db, max_workers=int(os.environ.get('USER_JOB_WORKERS', 2)))
+
+# Raw Spoonacular responses, kept on disk so the importer can replay them offline
+spoonacular_cache = ResponseCache.from_env()
+
+def invalidate_recipes(recipe_ids):
+    """Evict recipes from the cache after they were changed or deleted"""
+    for recipe_id in recipe_ids:
+        recipe_cache.invalidate(str(recipe_id))
+        recipe_card_cache.invalidate(str(recipe_id))
+        recipe_version_cache.invalidate(str(recipe_id))
+    listing_cache.clear()
+
+# Maximum number of document references sent in a single get_all call
+GET_ALL_CHUNK_SIZE = 100
+
+def get_recipe(recipe_id):
+    """Read a recipe through the cache, returning None if it does not exist"""
+    recipe = recipe_cache.get(recipe_id)
+    if recipe is None:
+        doc = db.collection('recipes').document(recipe_id).get()
+        if not doc.exists:
+            return None
+        recipe = doc.to_dict()
+        recipe_cache.set(recipe_id, recipe)
+    return dict(recipe)
+
+def get_recipe_cards_by_ids(recipe_ids):
+    """Fetch recipe cards in bulk, returning a dict keyed by recipe ID"""
+    cards_by_id = {}
+    missing_ids = []
+    
+    for recipe_id in dict.fromkeys(recipe_ids):
+        card = recipe_card_cache.get(recipe_id)
+        if card is None:
+            missing_ids.append(recipe_id)
+        else:
+            cards_by_id[recipe_id] = dict(card)
+    
+    # Cache misses are read from recipe_cards, then from the recipes themselves for
+    # recipes imported before cards existed, with the read limited to the card fields
+    recipes_ref = db.collection('recipes')
+    for start in range(0, len(missing_ids), GET_ALL_CHUNK_SIZE):
+        chunk = missing_ids[start:start + GET_ALL_CHUNK_SIZE]
+        for doc in db.get_all([recipe_card_ref(db, recipe_id) for recipe_id in chunk]):
+            card = doc.to_dict() if doc.exists else None
+            # A card without a title is incomplete, so read the recipe instead
+            if card and card.get('title'):
+                cards_by_id[doc.id] = card
+        
+        uncarded_ids = [recipe_id for recipe_id in chunk if recipe_id not in cards_by_id]
+        if uncarded_ids:
+            for doc in db.get_all([recipes_ref.document(recipe_id) for recipe_id in uncarded_ids],
+                                  field_paths=RECIPE_LISTING_FIELDS):
+                if doc.exists:
+                    cards_by_id[doc.id] = doc.to_dict()
+        
+        for recipe_id in chunk:
+            if recipe_id in cards_by_id:
+                recipe_card_cache.set(recipe_id, cards_by_id[recipe_id])
+                cards_by_id[recipe_id] = dict(cards_by_id[recipe_id])
+    
+    return cards_by_id
+
+def get_user_profile(user_id):
+    """Read a user's profile document through the cache, returning {} if it does not exist"""
+    profile = user_profile_cache.get(user_id)
+    if profile is None:
+        doc = db.collection('users').document(user_id).get()
+        profile = doc.to_dict() if doc.exists else {}
+        user_profile_cache.set(user_id, profile)
+    return dict(profile)
+
+# Poll for recipes and profiles changed by other processes (importer, photo migrator, other workers)
+CACHE_INVALIDATION_POLL_INTERVAL = 30
+
+def run_cache_invalidation_worker():
+    since = datetime.now(timezone.utc)
+    while True:
+        time.sleep(CACHE_INVALIDATION_POLL_INTERVAL)
+        try:
+            recipe_ids, user_ids, since = fetch_invalidations(db, since)
+            if recipe_ids:
+                invalidate_recipes(recipe_ids)
+                reindex_recipes(recipe_ids)
+                logger.info(f"Invalidated {len(recipe_ids)} cached recipes")
+            for user_id in user_ids:
+                user_profile_cache.invalidate(user_id)
+        except Exception as e:
+            logger.error(f"Error polling cache invalidations: {str(e)}")
+
+threading.Thread(target=run_cache_invalidation_worker, name='cache-invalidation', daemon=True).start()
+
+# Recipe search and facet indexes, built at startup and refreshed with newly imported recipes
+SEARCH_INDEX_FIELDS = ['id', 'title', 'image', 'image_variants', 'readyInMinutes', 'vegetarian', 'vegan',
+                       'glutenFree', 'dairyFree', 'dishTypes', 'ingredients', 'importedAt']
+SEARCH_INDEX_REFRESH_INTERVAL = 300
+search_index = RecipeSearchIndex()
+facet_index = RecipeFacetIndex()
+
+def index_recipe(recipe):
+    search_index.add_recipe(recipe)
+    facet_index.add_recipe(recipe)
+
+def unindex_recipe(recipe_id):
+    search_index.remove_recipe(recipe_id)
+    facet_index.remove_recipe(recipe_id)
+
+def reindex_recipes(recipe_ids):
+    """Re-read changed recipes into the indexes, dropping the ones that were deleted"""
+    recipes_ref = db.collection('recipes')
+    recipe_ids = list(dict.fromkeys(str(recipe_id) for recipe_id in recipe_ids))
+    for start in range(0, len(recipe_ids), GET_ALL_CHUNK_SIZE):
+        chunk = recipe_ids[start:start + GET_ALL_CHUNK_SIZE]
+        for doc in db.get_all([recipes_ref.document(recipe_id) for recipe_id in chunk],
+                              field_paths=SEARCH_INDEX_FIELDS):
+            if doc.exists:
+                recipe = doc.to_dict()
+                recipe.setdefault('id', doc.id)
+                index_recipe(recipe)
+            else:
+                unindex_recipe(doc.id)
+
+def refresh_recipe_indexes(imported_after=None):
+    """Index recipes imported after the given time, returning the newest importedAt seen"""
+    query = db.collection('recipes').select(SEARCH_INDEX_FIELDS)
+    if imported_after is not None:
+        query = query.where('importedAt', '>', imported_after)
+    
+    newest = imported_after
+    for doc in query.stream():
+        recipe = doc.to_dict()
+        recipe.setdefault('id', doc.id)
+        index_recipe(recipe)
+        imported_at = recipe.get('importedAt')
+        if imported_at is not None and (newest is None or imported_at > newest):
+            newest = imported_at
+    return newest
+
+def run_recipe_index_worker():
+    # Recipes imported by other processes (e.g. fetch_recipes.py) are picked up on refresh
+    imported_after = None
+    while True:
+        try:
+            imported_after = refresh_recipe_indexes(imported_after)
+            if not search_index.ready:
+                search_index.ready = True
+                logger.info(f"Recipe indexes built with {len(search_index)} recipes")
+        except Exception as e:
+            logger.error(f"Error refreshing recipe indexes: {str(e)}")
+        time.sleep(SEARCH_INDEX_REFRESH_INTERVAL)
+
+threading.Thread(target=run_recipe_index_worker, name='recipe-indexes', daemon=True).start()
+
+# Rating aggregates kept on each recipe document
+EMPTY_RATING_AGGREGATES = {
+    'rating_sum': 0,
+    'rating_count': 0,
+    'rating_avg': 0,
+    'rating_histogram': {str(star): 0 for star in range(1, 6)}
+}
+
+def build_rating_aggregates(recipe_data, added=(), removed=()):
+    """Compute a recipe's rating aggregate fields after adding/removing ratings"""
+    rating_sum = recipe_data.get('rating_sum', 0)
+    rating_count = recipe_data.get('rating_count', 0)
+    histogram = dict(EMPTY_RATING_AGGREGATES['rating_histogram'])
+    histogram.update(recipe_data.get('rating_histogram') or {})
+    
+    for rating in added:
+        rating_sum += rating
+        rating_count += 1
+        histogram[str(rating)] = histogram.get(str(rating), 0) + 1
+    
+    for rating in removed:
+        rating_sum = max(rating_sum - rating, 0)
+        rating_count = max(rating_count - 1, 0)
+        histogram[str(rating)] = max(histogram.get(str(rating), 0) - 1, 0)
+    
+    return {
+        'rating_sum': rating_sum,
+        'rating_count': rating_count,
+        'rating_avg': round(rating_sum / rating_count, 2) if rating_count else 0,
+        'rating_histogram': histogram
+    }
+
+@firestore.transactional
+def add_review_transaction(transaction, review_ref, review):
+    """Write a review and update its recipe's rating aggregates atomically"""
+    recipe_ref = db.collection('recipes').document(review['recipe_id'])
+    recipe_doc = recipe_ref.get(transaction=transaction)
+    
+    transaction.set(review_ref, review)
+    if recipe_doc.exists:
+        transaction.update(recipe_ref, build_rating_aggregates(recipe_doc.to_dict(), added=[review['rating']]))
+
+@firestore.transactional
+def delete_review_transaction(transaction, review_ref):
+    """Delete a review and update its recipe's rating aggregates, returning the recipe ID"""
+    review_doc = review_ref.get(transaction=transaction)
+    if not review_doc.exists:
+        return None
+    
+    review_data = review_doc.to_dict()
+    recipe_doc = None
+    if review_data.get('recipe_id') and isinstance(review_data.get('rating'), int):
+        recipe_doc = db.collection('recipes').document(review_data['recipe_id']).get(transaction=transaction)
+    
+    transaction.delete(review_ref)
+    if recipe_doc is not None and recipe_doc.exists:
+        transaction.update(recipe_doc.reference, build_rating_aggregates(recipe_doc.to_dict(), removed=[review_data['rating']]))
+    return review_data.get('recipe_id')
+
+@firestore.transactional
+def delete_reviews_transaction(transaction, recipe_ref, review_refs):
+    """Delete reviews of one recipe and take their ratings out of its aggregates atomically.
+
+    Returns the deleted reviews' data; reviews already gone are skipped.
+    """
+    review_docs = [doc for doc in db.get_all(review_refs, transaction=transaction) if doc.exists]
+    recipe_doc = recipe_ref.get(transaction=transaction)
+    
+    deleted = [doc.to_dict() for doc in review_docs]
+    for doc in review_docs:
+        transaction.delete(doc.reference)
+    
+    ratings = [review['rating'] for review in deleted if isinstance(review.get('rating'), int)]
+    if recipe_doc.exists and ratings:
+        transaction.update(recipe_ref, build_rating_aggregates(recipe_doc.to_dict(), removed=ratings))
+    return deleted
+
 # User class
 class User:
     def __init__(self, uid, email, display_name=None):
@@ -40,40 +378,40 @@ class User:
         self.display_name = display_name
         
     def get_saved_recipes(self):
-        """Get saved recipes with full recipe data"""
+        """Get saved recipes with their recipe cards"""
         saved_refs = db.collection('users').document(self.uid).collection('saved_recipes').stream()
+        # Only keep saved entries that reference a recipe
+        saved_items = [(doc.id, doc.to_dict()) for doc in saved_refs]
+        saved_items = [(doc_id, data) for doc_id, data in saved_items if 'recipe_id' in data]
+        
+        # Fetch all referenced recipe cards in bulk instead of one read per saved item
+        recipes_by_id = get_recipe_cards_by_ids([data['recipe_id'] for _, data in saved_items])
         saved_recipes = []
         
-        for doc in saved_refs:
-            saved_data = doc.to_dict()
-            saved_data['id'] = doc.id  # Add document ID
+        for doc_id, saved_data in saved_items:
+            recipe_id = saved_data['recipe_id']
             
-            # Only proceed if recipe_id exists
-            if 'recipe_id' in saved_data:
-                # Fetch the actual recipe data
-                recipe_ref = db.collection('recipes').document(saved_data['recipe_id']).get()
-                if recipe_ref.exists:
-                    # Create a nested structure with both saved info and recipe data
-                    complete_data = {
-                        'id': doc.id,
-                        'saved_at': saved_data.get('saved_at'),
-                        'recipe': recipe_ref.to_dict()
-                    }
-                    saved_recipes.append(complete_data)
-                else:
-                    # If recipe doesn't exist, still include minimal data
-                    logger.warning(f"Recipe {saved_data['recipe_id']} referenced in saved_recipes does not exist")
-                    complete_data = {
-                        'id': doc.id,
-                        'saved_at': saved_data.get('saved_at'),
-                        'recipe': {
-                            'id': saved_data['recipe_id'],
-                            'title': 'Unknown Recipe',
-                            'image': '',
-                            'readyInMinutes': 0
-                        }
+            if recipe_id in recipes_by_id:
+                # Create a nested structure with both saved info and recipe data
+                complete_data = {
+                    'id': doc_id,
+                    'saved_at': saved_data.get('saved_at'),
+                    'recipe': recipes_by_id[recipe_id]
+                }
+            else:
+                # If recipe doesn't exist, still include minimal data
+                logger.warning(f"Recipe {recipe_id} referenced in saved_recipes does not exist")
+                complete_data = {
+                    'id': doc_id,
+                    'saved_at': saved_data.get('saved_at'),
+                    'recipe': {
+                        'id': recipe_id,
+                        'title': 'Unknown Recipe',
+                        'image': '',
+                        'readyInMinutes': 0
                     }
-                    saved_recipes.append(complete_data)
+                }
+            saved_recipes.append(complete_data)
             
         return saved_recipes
     
@@ -84,30 +422,31 @@ class User:
         for doc in reviews_ref:
             review_data = doc.to_dict()
             review_data['id'] = doc.id  # Add the document ID
-            
-            # Try to fetch the recipe data for each review
-            if 'recipe_id' in review_data:
-                recipe_ref = db.collection('recipes').document(review_data['recipe_id']).get()
-                if recipe_ref.exists:
-                    review_data['recipe'] = recipe_ref.to_dict()
-                else:
-                    review_data['recipe'] = {
-                        'id': review_data['recipe_id'],
-                        'title': 'Unknown Recipe',
-                        'image': ''
-                    }
-            
             reviews_list.append(review_data)
+        
+        # Fetch the recipe cards for all reviews in bulk
+        recipes_by_id = get_recipe_cards_by_ids([r['recipe_id'] for r in reviews_list if 'recipe_id' in r])
+        
+        for review_data in reviews_list:
+            if 'recipe_id' in review_data:
+                review_data['recipe'] = recipes_by_id.get(review_data['recipe_id'], {
+                    'id': review_data['recipe_id'],
+                    'title': 'Unknown Recipe',
+                    'image': ''
+                })
             
         return reviews_list
 
 # Admin User class (inherits from User)
 class AdminUser(User):
     def delete_recipe(self, recipe_id):
-        db.collection('recipes').document(recipe_id).delete()
+        """Queue a cascading delete of a recipe and everything referencing it, returning the job ID"""
+        return job_runner.submit('delete_recipe', delete_recipe_cascade, recipe_id, created_by=self.uid)
         
     def delete_review(self, review_id):
-        db.collection('reviews').document(review_id).delete()
+        recipe_id = delete_review_transaction(db.transaction(), db.collection('reviews').document(review_id))
+        if recipe_id:
+            invalidate_recipes([recipe_id])
     
     def set_user_claims(self, uid, claims):
         auth.set_custom_user_claims(uid, claims)
@@ -119,7 +458,7 @@ def login_required(f):
         if 'user_id' not in session:
             flash('Please log in to access this page', 'warning')
             return redirect(url_for('login'))
-        return f(*args, **kwargs)
+        return app.ensure_sync(f)(*args, **kwargs)
     return decorated_function
 
 # Admin required decorator
@@ -129,16 +468,180 @@ def admin_required(f):
         if 'user_id' not in session or 'is_admin' not in session or not session['is_admin']:
             flash('Admin privileges required', 'danger')
             return redirect(url_for('index'))
-        return f(*args, **kwargs)
+        return app.ensure_sync(f)(*args, **kwargs)
     return decorated_function
 
+# Recipe listing helpers
+RECIPES_PAGE_SIZE = 24
+MAX_RECIPES_PAGE_SIZE = 100
+DIET_FILTERS = ('vegetarian', 'vegan', 'glutenFree', 'dairyFree')
+
+def encode_recipe_cursor(recipe):
+    """Encode the sort position of a recipe as an opaque page cursor"""
+    position = {'t': recipe.get('readyInMinutes', 0), 'id': recipe['id']}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_recipe_cursor(cursor):
+    """Decode a page cursor, raising ValueError if it is malformed"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {'t': int(position['t']), 'id': str(position['id'])}
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def parse_recipe_filters(args):
+    """Read the listing filters from the request query string"""
+    meal_types = args.getlist('mealType') + args.getlist('category')
+    return {
+        'diets': [diet for diet in DIET_FILTERS if args.get(diet, '').lower() in ('1', 'true', 'on')],
+        'meal_types': list(dict.fromkeys(t.lower() for t in meal_types if t)),
+        'max_time': args.get('maxTime', type=int)
+    }
+
+def parse_page_size(args):
+    page_size = args.get('limit', RECIPES_PAGE_SIZE, type=int)
+    return max(1, min(page_size, MAX_RECIPES_PAGE_SIZE))
+
+def query_recipes_page(filters, page_size, cursor=None):
+    """Read one page of recipe cards matching the filters, returning (recipes, next_cursor)"""
+    # Only the card fields are read; the cursor fields id and readyInMinutes are among them
+    query = db.collection('recipes').select(RECIPE_LISTING_FIELDS)
+    
+    # Diet flags and meal types are applied as Firestore query constraints
+    for diet in filters['diets']:
+        query = query.where(diet, '==', True)
+    if filters['meal_types']:
+        query = query.where('dishTypes', 'array_contains_any', filters['meal_types'][:30])
+    
+    # Inequality filters must be the first ordering, then order by id for a stable cursor
+    if filters['max_time'] is not None:
+        query = query.where('readyInMinutes', '<=', filters['max_time']).order_by('readyInMinutes')
+    query = query.order_by('id')
+    
+    if cursor:
+        position = decode_recipe_cursor(cursor)
+        start_after = {'id': position['id']}
+        if filters['max_time'] is not None:
+            start_after['readyInMinutes'] = position['t']
+        query = query.start_after(start_after)
+    
+    # Read one extra document to find out whether there is a next page
+    docs = list(query.limit(page_size + 1).stream())
+    recipes = [doc.to_dict() for doc in docs[:page_size]]
+    next_cursor = encode_recipe_cursor(recipes[-1]) if len(docs) > page_size else None
+    
+    return recipes, next_cursor
+
+# Conditional GET helpers
+def compute_template_version():
+    """Hash the templates so ETags change whenever the markup is redeployed"""
+    digest = hashlib.sha1()
+    template_dir = os.path.join(app.root_path, app.template_folder)
+    for root, _, files in sorted(os.walk(template_dir)):
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as f:
+                digest.update(name.encode())
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+TEMPLATE_VERSION = compute_template_version()
+
+def get_recipe_version(recipe_id):
+    """Return a version string for a recipe and its reviews, or None if it does not exist"""
+    version = recipe_version_cache.get(recipe_id)
+    if version is None:
+        doc = db.collection('recipes').document(recipe_id).get(field_paths=RECIPE_VERSION_FIELDS)
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        version = '|'.join(str(data.get(field, '')) for field in RECIPE_VERSION_FIELDS)
+        recipe_version_cache.set(recipe_id, version)
+    return version
+
+def make_etag(*parts):
+    # Pages differ for anonymous users, signed-in users and admins
+    viewer = f"{int(bool(session.get('user_id')))}{int(bool(session.get('is_admin')))}"
+    return hashlib.sha1('|'.join((TEMPLATE_VERSION, viewer) + tuple(map(str, parts))).encode()).hexdigest()
+
+def can_use_conditional_response():
+    # Pages with pending flash messages must always be rendered
+    return '_flashes' not in session
+
+def set_cache_headers(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache' if session.get('user_id') else 'public, no-cache'
+    return response
+
+def not_modified_response(etag):
+    return set_cache_headers(app.response_class(status=304), etag)
+
+def render_cached_fragment(cache_key, template_name, get_context):
+    """Render a template fragment, reusing the cached HTML for the same key"""
+    html = fragment_cache.get(cache_key)
+    if html is None:
+        html = Markup(render_template(template_name, **get_context()))
+        fragment_cache.set(cache_key, html)
+    return html
+
+# Request metrics, exposed in the Prometheus text format on /metrics, and the opt-in Firestore profiler
+@app.before_request
+def start_request_metrics():
+    g.metrics_started_at = time.perf_counter()
+    g.metrics_handle = metrics.start_request(request.endpoint or 'unmatched')
+    g.profile_handle = firestore_profiler.start_request(request.method, request.path, request.endpoint or 'unmatched')
+
+@app.after_request
+def record_request_metrics(response):
+    handle = g.pop('metrics_handle', None)
+    if handle is not None:
+        metrics.finish_request(handle, request.method, response.status_code,
+                               time.perf_counter() - g.metrics_started_at, response.calculate_content_length())
+    firestore_profiler.finish_request(g.pop('profile_handle', None), response.status_code)
+    return response
+
+@app.teardown_request
+def record_failed_request_metrics(error):
+    # Only reached with a handle left when the request failed before after_request ran
+    handle = g.pop('metrics_handle', None)
+    if handle is not None:
+        metrics.finish_request(handle, request.method, 500, time.perf_counter() - g.metrics_started_at)
+    firestore_profiler.finish_request(g.pop('profile_handle', None), 500)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Scrapers authenticate with a bearer token when METRICS_TOKEN is set
+    metrics_token = os.environ.get('METRICS_TOKEN')
+    if metrics_token and request.headers.get('Authorization') != f"Bearer {metrics_token}":
+        abort(403)
+    
+    body, content_type = metrics.render_metrics()
+    return app.response_class(body, headers={'Content-Type': content_type})
+
 # Routes
 @app.route('/')
 def index():
-    # Get featured recipes
-    recipes_ref = db.collection('recipes').limit(8).stream()
-    recipes = [doc.to_dict() for doc in recipes_ref]
-    return render_template('index.html', recipes=recipes)
+    # Get featured recipes, reading their cards through the card cache
+    featured_ids = listing_cache.get('featured')
+    if featured_ids is None:
+        featured_ids = [doc.id for doc in db.collection('recipes').select([]).limit(8).stream()]
+        listing_cache.set('featured', featured_ids)
+    
+    recipes_by_id = get_recipe_cards_by_ids(featured_ids)
+    recipes = [recipes_by_id[recipe_id] for recipe_id in featured_ids if recipe_id in recipes_by_id]
+    
+    version = hashlib.sha1('|'.join(
+        f"{recipe.get('id')}:{recipe.get('importedAt')}:{recipe.get('updatedAt')}" for recipe in recipes
+    ).encode()).hexdigest()
+    etag = make_etag('index', version)
+    conditional = can_use_conditional_response()
+    
+    if conditional and request.if_none_match.contains(etag):
+        return not_modified_response(etag)
+    
+    featured_recipes_html = render_cached_fragment(
+        ('featured', TEMPLATE_VERSION, version), '_featured_recipes.html', lambda: {'recipes': recipes})
+    response = app.make_response(render_template('index.html', featured_recipes_html=featured_recipes_html))
+    return set_cache_headers(response, etag) if conditional else response
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -156,38 +659,72 @@ def signup():
 
 @app.route('/recipes')
 def recipes():
-    # Get all recipes
-    recipes_ref = db.collection('recipes').stream()
-    recipes = [doc.to_dict() for doc in recipes_ref]
-    return render_template('recipes.html', recipes=recipes)
+    # Get one page of recipes matching the filters
+    filters = parse_recipe_filters(request.args)
+    
+    try:
+        recipes, next_cursor = query_recipes_page(filters, parse_page_size(request.args), request.args.get('start_after'))
+    except ValueError:
+        flash('Invalid page, showing the first page of recipes', 'warning')
+        recipes, next_cursor = query_recipes_page(filters, parse_page_size(request.args))
+    
+    next_url = None
+    if next_cursor:
+        next_args = request.args.to_dict(flat=False)
+        next_args['start_after'] = next_cursor
+        next_url = url_for('recipes', **next_args)
+    
+    return render_template('recipes.html', recipes=recipes, filters=filters, next_url=next_url)
 
 @app.route('/recipe/<recipe_id>')
-def recipe_detail(recipe_id):
-    # Get recipe details
-    recipe = db.collection('recipes').document(recipe_id).get().to_dict()
+async def recipe_detail(recipe_id):
+    # The version covers the recipe document and its review aggregates
+    version = get_recipe_version(recipe_id)
+    if version is None:
+        abort(404)
+    
+    etag = make_etag('recipe', recipe_id, version)
+    conditional = can_use_conditional_response()
+    
+    if conditional and request.if_none_match.contains(etag):
+        return not_modified_response(etag)
     
-    # Get reviews for this recipe
-    reviews_ref = db.collection('reviews').where('recipe_id', '==', recipe_id).stream()
-    reviews = [doc.to_dict() for doc in reviews_ref]
+    def get_reviews():
+        # Get reviews for this recipe
+        return [doc.to_dict() for doc in db.collection('reviews').where('recipe_id', '==', recipe_id).stream()]
     
-    return render_template('recipe_detail.html', recipe=recipe, reviews=reviews)
+    # Get recipe details, reading the reviews at the same time unless their fragment is cached
+    reviews_key = ('recipe_reviews', TEMPLATE_VERSION, recipe_id, version)
+    recipe_reviews_html = fragment_cache.get(reviews_key)
+    if recipe_reviews_html is None:
+        recipe, reviews = await gather_lookups(lambda: get_recipe(recipe_id), get_reviews)
+    else:
+        recipe = get_recipe(recipe_id)
+    if recipe is None:
+        abort(404)
+    
+    recipe_body_html = render_cached_fragment(
+        ('recipe_body', TEMPLATE_VERSION, recipe_id, version), '_recipe_body.html', lambda: {'recipe': recipe})
+    if recipe_reviews_html is None:
+        recipe_reviews_html = render_cached_fragment(reviews_key, '_recipe_reviews.html', lambda: {'reviews': reviews})
+    
+    response = app.make_response(render_template('recipe_detail.html', recipe=recipe,
+                                                  recipe_body_html=recipe_body_html,
+                                                  recipe_reviews_html=recipe_reviews_html))
+    return set_cache_headers(response, etag) if conditional else response
 
 @app.route('/account')
 @login_required
-def account():
-    # Get user info
+async def account():
+    # The saved recipes and reviews only need the user ID, so read them alongside the user document
     user_id = session['user_id']
-    user_doc = db.collection('users').document(user_id).get()
+    user = User(user_id, session.get('email'))
+    user_doc, saved_recipes, reviews = await gather_lookups(
+        db.collection('users').document(user_id).get, user.get_saved_recipes, user.get_reviews)
     
     if user_doc.exists:
         user_data = user_doc.to_dict()
-        if session.get('is_admin', False):
-            user = AdminUser(user_id, user_data.get('email'), user_data.get('display_name'))
-        else:
-            user = User(user_id, user_data.get('email'), user_data.get('display_name'))
-        
-        saved_recipes = user.get_saved_recipes()
-        reviews = user.get_reviews()
+        user_profile_cache.set(user_id, user_data)
         
         return render_template('account.html', user=user_data, saved_recipes=saved_recipes, reviews=reviews)
     
@@ -200,6 +737,63 @@ def admin_dashboard():
     return render_template('admin.html')
 
 # API routes for AJAX calls
+@app.route('/api/recipes', methods=['GET'])
+def api_recipes():
+    filters = parse_recipe_filters(request.args)
+    
+    try:
+        recipes, next_cursor = query_recipes_page(filters, parse_page_size(request.args), request.args.get('start_after'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify({'success': True, 'recipes': recipes, 'next_cursor': next_cursor})
+
+@app.route('/api/search', methods=['GET'])
+def search_recipes():
+    query = request.args.get('q', '').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    page_size = parse_page_size(request.args)
+    
+    if not search_index.ready:
+        return jsonify({'success': False, 'error': 'Search index is still loading'}), 503
+    
+    total, results = search_index.search(query, offset=(page - 1) * page_size, limit=page_size)
+    
+    return jsonify({
+        'success': True,
+        'query': query,
+        'total': total,
+        'page': page,
+        'has_more': page * page_size < total,
+        'recipes': results
+    })
+
+@app.route('/api/facets', methods=['GET'])
+def recipe_facets():
+    filters = parse_recipe_filters(request.args)
+    page = max(1, request.args.get('page', 1, type=int))
+    page_size = parse_page_size(request.args)
+    
+    if not search_index.ready:
+        return jsonify({'success': False, 'error': 'Recipe index is still loading'}), 503
+    
+    total, recipe_ids, counts = facet_index.query(
+        diets=filters['diets'],
+        meal_types=filters['meal_types'],
+        max_time=filters['max_time'],
+        offset=(page - 1) * page_size,
+        limit=page_size
+    )
+    
+    return jsonify({
+        'success': True,
+        'total': total,
+        'page': page,
+        'has_more': page * page_size < total,
+        'counts': counts,
+        'recipes': search_index.get_cards(recipe_ids)
+    })
+
 @app.route('/api/save-recipe', methods=['POST'])
 @login_required
 def save_recipe():
@@ -244,10 +838,11 @@ def add_review():
     storage_path = data.get('storage_path')
     user_id = session['user_id']
     
+    if not recipe_id or not isinstance(rating, int) or not 1 <= rating <= 5:
+        return jsonify({'success': False, 'error': 'A recipe and a rating from 1 to 5 are required'}), 400
+    
     # Get user info to include in review
-    user_doc = db.collection('users').document(user_id).get()
-    user_data = user_doc.to_dict()
-    user_name = user_data.get('display_name', 'Anonymous')
+    user_name = get_user_profile(user_id).get('display_name', 'Anonymous')
     
     # Create review object
     review = {
@@ -265,11 +860,65 @@ def add_review():
         if storage_path:
             review['storage_path'] = storage_path
     
-    # Add review to Firestore
-    db.collection('reviews').add(review)
+    # Add review to Firestore and update the recipe's rating aggregates
+    add_review_transaction(db.transaction(), db.collection('reviews').document(), review)
+    invalidate_recipes([recipe_id])
     
     return jsonify({'success': True})
 
+# Firestore allows at most 500 writes per batch
+REVIEW_RENAME_BATCH_SIZE = 500
+
+def rename_stale_reviews(job, user_id):
+    """Copy a user's current display name into reviews that carry another one, returning the count"""
+    user_doc = db.collection('users').document(user_id).get()
+    user_name = (user_doc.to_dict() or {}).get('display_name', 'Anonymous') if user_doc.exists else 'Anonymous'
+    
+    stale_reviews = [doc for doc in db.collection('reviews').where('user_id', '==', user_id).stream()
+                     if doc.to_dict().get('user_name') != user_name]
+    job.progress(0, len(stale_reviews), 'Updating reviews')
+    
+    recipe_ids = set()
+    for start in range(0, len(stale_reviews), REVIEW_RENAME_BATCH_SIZE):
+        batch = db.batch()
+        for doc in stale_reviews[start:start + REVIEW_RENAME_BATCH_SIZE]:
+            batch.update(doc.reference, {'user_name': user_name})
+            recipe_ids.add(doc.to_dict().get('recipe_id'))
+        batch.commit()
+        job.progress(min(start + REVIEW_RENAME_BATCH_SIZE, len(stale_reviews)), len(stale_reviews))
+    
+    # Bump the recipes' versions so cached review fragments and ETags are refreshed,
+    # skipping deleted recipes that orphaned reviews still point at
+    recipes_ref = db.collection('recipes')
+    recipe_ids = sorted(recipe_id for recipe_id in recipe_ids if recipe_id)
+    existing_ids = []
+    for start in range(0, len(recipe_ids), GET_ALL_CHUNK_SIZE):
+        chunk = recipe_ids[start:start + GET_ALL_CHUNK_SIZE]
+        existing_ids.extend(doc.id for doc in db.get_all([recipes_ref.document(recipe_id) for recipe_id in chunk],
+                                                         field_paths=['id']) if doc.exists)
+    for start in range(0, len(existing_ids), REVIEW_RENAME_BATCH_SIZE):
+        batch = db.batch()
+        for recipe_id in existing_ids[start:start + REVIEW_RENAME_BATCH_SIZE]:
+            batch.update(recipes_ref.document(recipe_id), {'updatedAt': firestore.SERVER_TIMESTAMP})
+        batch.commit()
+    if existing_ids:
+        invalidate_recipes(existing_ids)
+        publish_recipe_invalidations(db, existing_ids)
+    
+    return len(stale_reviews)
+
+def rename_user_reviews(job, user_id):
+    """Job: copy a user's current display name into all of their reviews"""
+    catch_up_at = time.time() + CACHE_INVALIDATION_POLL_INTERVAL + 5
+    reviews_updated = rename_stale_reviews(job, user_id)
+    
+    # Other workers may write reviews with the old name until they evict their cached
+    # profile on their next invalidation poll, so fix those once that has happened
+    time.sleep(max(0, catch_up_at - time.time()))
+    reviews_updated += rename_stale_reviews(job, user_id)
+    
+    return {'reviews_updated': reviews_updated}
+
 @app.route('/api/update-profile', methods=['POST'])
 @login_required
 def update_profile():
@@ -290,6 +939,12 @@ def update_profile():
     
     if update_data:
         db.collection('users').document(user_id).update(update_data)
+        user_profile_cache.invalidate(user_id)
+        publish_user_invalidations(db, [user_id])
+        
+        # Existing reviews carry a copy of the display name, so correct them in the background
+        if 'display_name' in update_data:
+            user_job_runner.submit('rename_user_reviews', rename_user_reviews, user_id, created_by=user_id)
         
     return jsonify({'success': True})
 
@@ -318,7 +973,7 @@ def create_session():
     try:
         # Verify the ID token
         logger.info("Verifying ID token")
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = token_verifier.verify(id_token)
         user_id = decoded_token['uid']
         
         logger.info(f"Token verified for user: {user_id}")
@@ -327,22 +982,19 @@ def create_session():
         session['user_id'] = user_id
         session['email'] = decoded_token.get('email', '')
         
-        # Check if user is admin
-        user_record = auth.get_user(user_id)
-        
-        # Check custom claims for admin status
-        if user_record.custom_claims and user_record.custom_claims.get('admin'):
+        # Admins carry a custom claim in the token, so their logins need no lookups
+        if decoded_token.get('admin'):
             session['is_admin'] = True
-            logger.info(f"User {user_id} is an admin (from custom claims)")
+            logger.info(f"User {user_id} is an admin (from token claims)")
         else:
-            # Also check Firestore document for admin status
+            # Admin can also be granted on the Firestore user document, so check it
             user_doc = db.collection('users').document(user_id).get()
             if user_doc.exists and user_doc.to_dict().get('is_admin', False):
                 session['is_admin'] = True
                 
-                # If admin in Firestore but not in custom claims, update custom claims
-                if not (user_record.custom_claims and user_record.custom_claims.get('admin')):
-                    auth.set_custom_user_claims(user_id, {'admin': True})
+                # Sync the claim so later tokens skip this lookup
+                user_record = auth.get_user(user_id)
+                auth.set_custom_user_claims(user_id, {**(user_record.custom_claims or {}), 'admin': True})
                 logger.info(f"User {user_id} is an admin (from Firestore)")
             else:
                 session['is_admin'] = False
@@ -365,9 +1017,85 @@ def logout():
     session.clear()
     return jsonify({'success': True})
 
-@app.route('/api/fetch-recipes', methods=['GET'])
+def import_random_recipes(job, api_key):
+    """Job: fetch a page of random recipes from Spoonacular and store them in Firestore"""
+    job.progress(0, message='Fetching recipes from Spoonacular')
+    
+    # Make request to Spoonacular API
+    url = f"https://api.spoonacular.com/recipes/random?number=30&apiKey={api_key}"
+    response = requests.get(url, timeout=60)
+    data = response.json()
+    
+    if response.ok:
+        try:
+            spoonacular_cache.put('random', {'number': 30}, data)
+        except Exception as e:
+            logger.warning(f"Could not cache Spoonacular response: {str(e)}")
+    
+    # Recipes already stored are skipped, so their ratings and migrated images survive
+    recipes_ref = db.collection('recipes')
+    fetched = [recipe_data for recipe_data in data.get('recipes', []) if 'id' in recipe_data]
+    existing_ids = {doc.id for doc in db.get_all([recipes_ref.document(str(recipe_data['id']))
+                                                  for recipe_data in fetched], field_paths=['id'])
+                    if doc.exists} if fetched else set()
+    
+    # Store recipes in Firestore
+    recipes_batch = db.batch()
+    imported_recipes = []
+    
+    for recipe_data in fetched:
+        if str(recipe_data['id']) in existing_ids:
+            continue
+        recipe_ref = recipes_ref.document(str(recipe_data['id']))
+        
+        # Extract the relevant information
+        recipe = {
+            'id': str(recipe_data['id']),
+            'title': recipe_data['title'],
+            'image': recipe_data.get('image', ''),
+            'readyInMinutes': recipe_data.get('readyInMinutes', 0),
+            'servings': recipe_data.get('servings', 1),
+            'summary': recipe_data.get('summary', ''),
+            'instructions': recipe_data.get('instructions', ''),
+            'vegetarian': recipe_data.get('vegetarian', False),
+            'vegan': recipe_data.get('vegan', False),
+            'glutenFree': recipe_data.get('glutenFree', False),
+            'dairyFree': recipe_data.get('dairyFree', False),
+            'dishTypes': recipe_data.get('dishTypes', []),
+            'ingredients': [
+                {
+                    'id': ingredient.get('id', 0),
+                    'name': ingredient.get('name', ''),
+                    'amount': ingredient.get('amount', 0),
+                    'unit': ingredient.get('unit', '')
+                }
+                for ingredient in recipe_data.get('extendedIngredients', [])
+            ],
+            'importedAt': firestore.SERVER_TIMESTAMP
+        }
+        
+        recipes_batch.set(recipe_ref, recipe)
+        recipes_batch.set(recipe_card_ref(db, recipe['id']), build_recipe_card(recipe))
+        imported_recipes.append(recipe)
+    
+    # Commit the batch
+    job.progress(0, len(imported_recipes), 'Storing recipes')
+    if imported_recipes:
+        recipes_batch.commit()
+    
+    # Make the imported recipes searchable and filterable right away
+    for recipe in imported_recipes:
+        index_recipe(recipe)
+    imported_ids = [recipe['id'] for recipe in imported_recipes]
+    if imported_ids:
+        invalidate_recipes(imported_ids)
+        publish_recipe_invalidations(db, imported_ids)
+    
+    return {'recipes_imported': len(imported_recipes), 'recipes_skipped': len(existing_ids)}
+
+@app.route('/api/fetch-recipes', methods=['POST'])
 def fetch_recipes_from_api():
-    # This endpoint will fetch recipes from Spoonacular API and store them in Firestore
+    # This endpoint queues a job that fetches recipes from Spoonacular API and stores them in Firestore
     # This would typically be called by an admin or a scheduled task
     
     if 'user_id' not in session or not session.get('is_admin', False):
@@ -378,75 +1106,73 @@ def fetch_recipes_from_api():
         return jsonify({'success': False, 'error': 'API key not configured'}), 500
     
     try:
-        # Make request to Spoonacular API
-        url = f"https://api.spoonacular.com/recipes/random?number=30&apiKey={api_key}"
-        response = requests.get(url)
-        data = response.json()
-        
-        # Store recipes in Firestore
-        recipes_batch = db.batch()
-        
-        for recipe_data in data.get('recipes', []):
-            recipe_ref = db.collection('recipes').document(str(recipe_data['id']))
-            
-            # Extract the relevant information
-            recipe = {
-                'id': str(recipe_data['id']),
-                'title': recipe_data['title'],
-                'image': recipe_data.get('image', ''),
-                'readyInMinutes': recipe_data.get('readyInMinutes', 0),
-                'servings': recipe_data.get('servings', 1),
-                'summary': recipe_data.get('summary', ''),
-                'instructions': recipe_data.get('instructions', ''),
-                'vegetarian': recipe_data.get('vegetarian', False),
-                'vegan': recipe_data.get('vegan', False),
-                'glutenFree': recipe_data.get('glutenFree', False),
-                'dairyFree': recipe_data.get('dairyFree', False),
-                'dishTypes': recipe_data.get('dishTypes', []),
-                'ingredients': [
-                    {
-                        'id': ingredient.get('id', 0),
-                        'name': ingredient.get('name', ''),
-                        'amount': ingredient.get('amount', 0),
-                        'unit': ingredient.get('unit', '')
-                    }
-                    for ingredient in recipe_data.get('extendedIngredients', [])
-                ],
-                'importedAt': firestore.SERVER_TIMESTAMP
-            }
-            
-            recipes_batch.set(recipe_ref, recipe)
-        
-        # Commit the batch
-        recipes_batch.commit()
-        
-        return jsonify({'success': True, 'recipes_imported': len(data.get('recipes', []))})
+        job_id = job_runner.submit('import_recipes', import_random_recipes, api_key,
+                                   created_by=session['user_id'])
+        return jsonify({'success': True, 'job_id': job_id}), 202
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    if not session.get('is_admin'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    
+    try:
+        job = job_runner.get(job_id)
+        if job is None:
+            return jsonify({'success': False, 'error': 'Job not found'}), 404
+        return jsonify({'success': True, 'job': job})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 # API routes for admin actions
+# Admin statistics are cached briefly so dashboard loads cost a few count queries at most
+ADMIN_STATS_TTL = 60
+admin_stats_cache = {'stats': None, 'expires_at': 0}
+admin_stats_lock = threading.Lock()
+
+def count_documents(collection_name):
+    """Count a collection with a server-side aggregation query"""
+    result = db.collection(collection_name).count().get()
+    return int(result[0][0].value)
+
+def get_cached_admin_stats():
+    with admin_stats_lock:
+        if admin_stats_cache['stats'] is not None and time.monotonic() < admin_stats_cache['expires_at']:
+            return admin_stats_cache['stats']
+        
+        # Run the three count queries concurrently
+        futures = {
+            key: submit_lookup(count_documents, collection_name)
+            for key, collection_name in (('total_users', 'users'), ('total_recipes', 'recipes'), ('total_reviews', 'reviews'))
+        }
+        stats = {key: future.result() for key, future in futures.items()}
+        
+        admin_stats_cache['stats'] = stats
+        admin_stats_cache['expires_at'] = time.monotonic() + ADMIN_STATS_TTL
+        return stats
+
 @app.route('/api/admin/stats', methods=['GET'])
 @login_required
 @admin_required
 def get_admin_stats():
     # Get admin dashboard statistics
     try:
-        users_count = len(list(db.collection('users').stream()))
-        recipes_count = len(list(db.collection('recipes').stream()))
-        reviews_count = len(list(db.collection('reviews').stream()))
-        
-        stats = {
-            'total_users': users_count,
-            'total_recipes': recipes_count,
-            'total_reviews': reviews_count
-        }
-        
+        stats = get_cached_admin_stats()
         return jsonify({'success': True, 'stats': stats})
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/admin/cache-stats', methods=['GET'])
+@login_required
+@admin_required
+def get_cache_stats():
+    return jsonify({'success': True, 'recipe_cache': recipe_cache.stats(),
+                    'recipe_card_cache': recipe_card_cache.stats(), 'listing_cache': listing_cache.stats()})
+
 @app.route('/api/admin/set-admin-claim', methods=['POST'])
 @login_required
 @admin_required
@@ -485,7 +1211,9 @@ def delete_review(review_id):
         
         # Check if user is the review author or an admin
         if review_data.get('user_id') == user_id or is_admin:
-            review_ref.delete()
+            recipe_id = delete_review_transaction(db.transaction(), review_ref)
+            if recipe_id:
+                invalidate_recipes([recipe_id])
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'error': 'Not authorized to delete this review'}), 403
@@ -508,27 +1236,226 @@ def delete_saved_recipe(saved_id):
 @app.route('/api/admin/top-recipes')
 def get_top_recipes():
     try:
-        recipes_ref = db.collection('recipes')
+        # Read the highest rated recipes straight from their stored aggregates
+        recipes_ref = (db.collection('recipes')
+                       .where('rating_avg', '>', 0)
+                       .order_by('rating_avg', direction=firestore.Query.DESCENDING)
+                       .select(['title', 'rating_avg', 'rating_count'])
+                       .limit(10))
+        
         top_recipes = []
-
-        # Get all recipes with reviews
         for recipe_doc in recipes_ref.stream():
             recipe = recipe_doc.to_dict()
-            reviews_ref = db.collection('reviews').where('recipe_id', '==', recipe_doc.id)
-            reviews = [r.to_dict() for r in reviews_ref.stream()]
-            
-            if reviews:
-                avg_rating = sum(r['rating'] for r in reviews) / len(reviews)
-                top_recipes.append({
-                    'id': recipe_doc.id,
-                    'title': recipe.get('title'),
-                    'avg_rating': round(avg_rating, 1),
-                    'review_count': len(reviews)
-                })
+            top_recipes.append({
+                'id': recipe_doc.id,
+                'title': recipe.get('title'),
+                'avg_rating': round(recipe.get('rating_avg', 0), 1),
+                'review_count': recipe.get('rating_count', 0)
+            })
+        
+        return jsonify({'success': True, 'recipes': top_recipes})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+# Reviews deleted per transaction; stays under Firestore's 500 writes (plus the recipe update)
+REVIEW_DELETE_PAGE_SIZE = 400
+BLOB_DELETE_WORKERS = 8
+
+# Documents that may point at an uploaded photo through their storage_path
+STORAGE_PATH_COLLECTIONS = ('reviews', 'recipes', 'users')
+
+def is_blob_referenced(storage_path):
+    """Check whether any document still uses a blob; migrated photos are deduplicated and can be shared"""
+    for collection_name in STORAGE_PATH_COLLECTIONS:
+        query = db.collection(collection_name).where('storage_path', '==', storage_path).select([]).limit(1)
+        if any(True for _ in query.stream()):
+            return True
+    return False
+
+def delete_blob_if_unreferenced(bucket, storage_path, check_references=True):
+    """Delete a blob nothing points at any more, returning 'deleted', 'shared' or 'missing'"""
+    if check_references and is_blob_referenced(storage_path):
+        return 'shared'
+    try:
+        bucket.blob(storage_path).delete()
+        return 'deleted'
+    except google_exceptions.NotFound:
+        return 'missing'
+
+def delete_blobs(storage_paths, check_references=True):
+    """Delete unreferenced blobs concurrently, returning counts by outcome"""
+    counts = {'deleted': 0, 'shared': 0, 'missing': 0, 'failed': 0}
+    if not storage_paths:
+        return counts
+    
+    bucket = storage.bucket(STORAGE_BUCKET)
+    with ThreadPoolExecutor(max_workers=BLOB_DELETE_WORKERS) as executor:
+        futures = {executor.submit(delete_blob_if_unreferenced, bucket, path, check_references): path for path in storage_paths}
+        for future, path in futures.items():
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                logger.error(f"Failed to delete blob {path}: {str(e)}")
+                counts['failed'] += 1
+    return counts
 
-        # Sort by rating descending
-        top_recipes.sort(key=lambda x: x['avg_rating'], reverse=True)
-        return jsonify({'success': True, 'recipes': top_recipes[:10]})
+def delete_all_recipe_reviews(job, recipe_id):
+    """Job: delete every review of a recipe, with their photos, keeping its rating aggregates consistent"""
+    reviews_query = db.collection('reviews').where('recipe_id', '==', recipe_id)
+    total = int(reviews_query.count().get()[0][0].value)
+    job.progress(0, total, 'Deleting reviews')
+    
+    recipe_ref = db.collection('recipes').document(recipe_id)
+    page_query = reviews_query.order_by(FieldPath.document_id()).select([]).limit(REVIEW_DELETE_PAGE_SIZE)
+    reviews_deleted = 0
+    blob_counts = {'deleted': 0, 'shared': 0, 'missing': 0, 'failed': 0}
+    last_doc = None
+    
+    while True:
+        # Page through the reviews by document ID, reading only their references
+        query = page_query.start_after(last_doc) if last_doc is not None else page_query
+        page = list(query.stream())
+        if not page:
+            break
+        last_doc = page[-1]
+        
+        # Each page is deleted in one transaction that also updates the aggregates,
+        # so reviews added or removed meanwhile are accounted for correctly
+        deleted = delete_reviews_transaction(db.transaction(), recipe_ref, [doc.reference for doc in page])
+        reviews_deleted += len(deleted)
+        
+        # Blobs go only after the documents, so the reference check no longer sees these reviews
+        storage_paths = set(review['storage_path'] for review in deleted if review.get('storage_path'))
+        for outcome, count in delete_blobs(storage_paths).items():
+            blob_counts[outcome] += count
+        
+        job.progress(reviews_deleted, total)
+    
+    invalidate_recipes([recipe_id])
+    logger.info(f"Deleted {reviews_deleted} reviews and {blob_counts['deleted']} photos of recipe {recipe_id} "
+                f"({blob_counts['shared']} shared photos kept, {blob_counts['failed']} failed)")
+    
+    return {
+        'reviews_deleted': reviews_deleted,
+        'blobs_deleted': blob_counts['deleted'],
+        'blobs_shared': blob_counts['shared'],
+        'blobs_missing': blob_counts['missing'],
+        'blobs_failed': blob_counts['failed']
+    }
+
+# Progress of cascading recipe deletes, kept so an interrupted delete can be re-run to completion
+RECIPE_DELETIONS_COLLECTION = 'recipe_deletions'
+CASCADE_DELETE_PAGE_SIZE = 500
+
+def recipe_image_paths(recipe_data):
+    """Return the storage paths of a recipe's migrated image and its resized variants"""
+    variant_paths = []
+    for variant in (recipe_data.get('image_variants') or {}).values():
+        for rendition in variant.values():
+            if isinstance(rendition, dict) and rendition.get('path'):
+                variant_paths.append(rendition['path'])
+    return {'storage_path': recipe_data.get('storage_path'), 'variant_paths': variant_paths}
+
+def delete_recipe_cascade(job, recipe_id):
+    """Job: delete a recipe with its saved_recipes entries, reviews, review photos and images.
+
+    Every step re-queries what is left, and photo paths are recorded before the
+    documents pointing at them are deleted, so re-running an interrupted delete
+    finishes it and re-running a finished one is a no-op.
+    """
+    recipe_ref = db.collection('recipes').document(recipe_id)
+    tombstone_ref = db.collection(RECIPE_DELETIONS_COLLECTION).document(recipe_id)
+    tombstone = tombstone_ref.get()
+    state = tombstone.to_dict() if tombstone.exists else {}
+    
+    # Remember the recipe's images before the document goes away
+    recipe_doc = recipe_ref.get()
+    if recipe_doc.exists:
+        state['image_paths'] = recipe_image_paths(recipe_doc.to_dict())
+    tombstone_ref.set({
+        'status': 'running',
+        'image_paths': state.get('image_paths') or {'storage_path': None, 'variant_paths': []},
+        'updated_at': firestore.SERVER_TIMESTAMP
+    }, merge=True)
+    
+    counts = {'saved_recipes_deleted': 0, 'reviews_deleted': 0, 'blobs_deleted': 0, 'blobs_shared': 0,
+              'blobs_missing': 0, 'blobs_failed': 0}
+    
+    def delete_photos(storage_paths, check_references=True):
+        for outcome, count in delete_blobs(storage_paths, check_references).items():
+            counts[f"blobs_{outcome}"] += count
+    
+    # Finish review photo deletes an interrupted run had started
+    if state.get('pending_blobs'):
+        delete_photos(set(state['pending_blobs']))
+        tombstone_ref.update({'pending_blobs': firestore.ArrayRemove(state['pending_blobs'])})
+    
+    # Users' saved entries, found across all users with a collection group query on recipe_id
+    saved_query = db.collection_group('saved_recipes').where('recipe_id', '==', recipe_id).select([])
+    while True:
+        page = list(saved_query.limit(CASCADE_DELETE_PAGE_SIZE).stream())
+        if not page:
+            break
+        batch = db.batch()
+        for doc in page:
+            batch.delete(doc.reference)
+        batch.commit()
+        counts['saved_recipes_deleted'] += len(page)
+        job.progress(counts['saved_recipes_deleted'], message='Deleting saved recipes')
+    
+    # Reviews, recording their photo paths first so a crash can't orphan the blobs
+    reviews_query = db.collection('reviews').where('recipe_id', '==', recipe_id).select(['storage_path'])
+    while True:
+        page = list(reviews_query.limit(CASCADE_DELETE_PAGE_SIZE).stream())
+        if not page:
+            break
+        storage_paths = sorted(set(doc.to_dict().get('storage_path') for doc in page) - {None, ''})
+        if storage_paths:
+            tombstone_ref.update({'pending_blobs': firestore.ArrayUnion(storage_paths)})
+        
+        batch = db.batch()
+        for doc in page:
+            batch.delete(doc.reference)
+        batch.commit()
+        counts['reviews_deleted'] += len(page)
+        
+        if storage_paths:
+            delete_photos(storage_paths)
+            tombstone_ref.update({'pending_blobs': firestore.ArrayRemove(storage_paths)})
+        job.progress(counts['reviews_deleted'], message='Deleting reviews')
+    
+    # The recipe itself and its card
+    recipe_ref.delete()
+    recipe_card_ref(db, recipe_id).delete()
+    unindex_recipe(recipe_id)
+    invalidate_recipes([recipe_id])
+    publish_recipe_invalidations(db, [recipe_id])
+    
+    # Its image and variants, unless deduplication shares them with another recipe
+    image_paths = state.get('image_paths') or {}
+    storage_path = image_paths.get('storage_path')
+    if storage_path and is_blob_referenced(storage_path):
+        counts['blobs_shared'] += 1 + len(image_paths.get('variant_paths') or [])
+    else:
+        # Variants are only ever shared along with the original, which was just checked
+        delete_photos([path for path in [storage_path] + list(image_paths.get('variant_paths') or []) if path],
+                      check_references=False)
+    
+    tombstone_ref.set({'status': 'done', 'counts': counts, 'updated_at': firestore.SERVER_TIMESTAMP}, merge=True)
+    logger.info(f"Deleted recipe {recipe_id}: {counts}")
+    return counts
+
+@app.route('/api/admin/recipes/<recipe_id>', methods=['DELETE'])
+def delete_recipe(recipe_id):
+    try:
+        # Verify admin
+        if not session.get('is_admin'):
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+        
+        admin = AdminUser(session['user_id'], session.get('email'))
+        job_id = admin.delete_recipe(recipe_id)
+        return jsonify({'success': True, 'job_id': job_id}), 202
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -540,16 +1467,9 @@ def delete_recipe_reviews(recipe_id):
         if not session.get('is_admin'):
             return jsonify({'success': False, 'error': 'Unauthorized'}), 403
 
-        # Delete all reviews for this recipe
-        reviews_ref = db.collection('reviews').where('recipe_id', '==', recipe_id)
-        for review in reviews_ref.stream():
-            # Delete any associated photos
-            if review.to_dict().get('storage_path'):
-                bucket = storage.bucket()
-                bucket.blob(review.to_dict()['storage_path']).delete()
-            review.reference.delete()
-
-        return jsonify({'success': True})
+        job_id = job_runner.submit('delete_recipe_reviews', delete_all_recipe_reviews, recipe_id,
+                                   created_by=session.get('user_id'))
+        return jsonify({'success': True, 'job_id': job_id}), 202
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
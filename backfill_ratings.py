@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+RecipeHub Rating Aggregate Backfill
+-----------------------------------
+Computes the rating aggregates (rating_sum, rating_count, rating_avg and
+rating_histogram) for every recipe from the existing reviews and stores them
+on the recipe documents. Run it once after deploying the aggregate fields, or
+whenever the aggregates need to be rebuilt from scratch.
+
+Usage:
+    python backfill_ratings.py
+"""
+
+import time
+import logging
+from logging_setup import configure_logging
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+# Set up logging
+configure_logging("rating_backfill.log")
+logger = logging.getLogger("rating_backfill")
+
+# Initialize Firebase
+try:
+    firebase_admin.get_app()
+except ValueError:
+    cred = credentials.Certificate("firebase-key.json")
+    firebase_admin.initialize_app(cred)
+
+db = firestore.client()
+
+# Firestore allows at most 500 writes per batch
+BATCH_SIZE = 500
+
+def empty_aggregates():
+    return {
+        'rating_sum': 0,
+        'rating_count': 0,
+        'rating_avg': 0,
+        'rating_histogram': {str(star): 0 for star in range(1, 6)}
+    }
+
+def compute_aggregates():
+    """Scan all reviews once and aggregate their ratings per recipe"""
+    aggregates = {}
+    
+    for doc in db.collection('reviews').select(['recipe_id', 'rating']).stream():
+        review = doc.to_dict()
+        recipe_id = review.get('recipe_id')
+        rating = review.get('rating')
+        
+        if not recipe_id or not isinstance(rating, int):
+            logger.warning(f"Skipping review {doc.id} without a valid recipe_id/rating")
+            continue
+        
+        recipe_aggregates = aggregates.setdefault(recipe_id, empty_aggregates())
+        recipe_aggregates['rating_sum'] += rating
+        recipe_aggregates['rating_count'] += 1
+        histogram = recipe_aggregates['rating_histogram']
+        histogram[str(rating)] = histogram.get(str(rating), 0) + 1
+    
+    for recipe_aggregates in aggregates.values():
+        recipe_aggregates['rating_avg'] = round(recipe_aggregates['rating_sum'] / recipe_aggregates['rating_count'], 2)
+    
+    return aggregates
+
+def main():
+    """Write rating aggregates to every recipe document"""
+    start_time = time.time()
+    logger.info("Computing rating aggregates from reviews...")
+    aggregates = compute_aggregates()
+    logger.info(f"Found ratings for {len(aggregates)} recipes")
+    
+    batch = db.batch()
+    pending = 0
+    updated = 0
+    
+    # Recipes without reviews get zeroed aggregates so stale values are cleared
+    for doc in db.collection('recipes').select([]).stream():
+        batch.update(doc.reference, aggregates.get(doc.id, empty_aggregates()))
+        pending += 1
+        updated += 1
+        
+        if pending == BATCH_SIZE:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    
+    if pending:
+        batch.commit()
+    
+    logger.info(f"Rating backfill complete. Updated {updated} recipes in {time.time() - start_time:.2f} seconds")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+RecipeHub Recipe Card Backfill
+------------------------------
+Writes the compact recipe_cards document (see recipe_cards.py) for every
+recipe, reading only the card fields. Run it once after deploying recipe
+cards, or whenever the cards need to be rebuilt from the recipes. Until then
+listing pages fall back to field-masked reads of the recipes themselves.
+
+Usage:
+    python backfill_recipe_cards.py
+"""
+
+import time
+import logging
+from logging_setup import configure_logging
+import firebase_admin
+from firebase_admin import credentials, firestore
+from recipe_cards import RECIPE_CARD_FIELDS, build_recipe_card, recipe_card_ref
+
+# Set up logging
+configure_logging("recipe_card_backfill.log")
+logger = logging.getLogger("recipe_card_backfill")
+
+# Initialize Firebase
+try:
+    firebase_admin.get_app()
+except ValueError:
+    cred = credentials.Certificate("firebase-key.json")
+    firebase_admin.initialize_app(cred)
+
+db = firestore.client()
+
+# Firestore allows at most 500 writes per batch
+BATCH_SIZE = 500
+
+def main():
+    """Write a recipe card for every recipe document"""
+    start_time = time.time()
+    batch = db.batch()
+    pending = 0
+    written = 0
+    
+    for doc in db.collection('recipes').select(RECIPE_CARD_FIELDS).stream():
+        batch.set(recipe_card_ref(db, doc.id), build_recipe_card(doc.to_dict()))
+        pending += 1
+        written += 1
+        
+        if pending == BATCH_SIZE:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    
+    if pending:
+        batch.commit()
+    
+    logger.info(f"Recipe card backfill complete. Wrote {written} cards in {time.time() - start_time:.2f} seconds")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Cross-process cache invalidation.
+
+The web app caches recipe documents and user profiles in memory. Whatever
+changes them in another process (the importer, the photo migrator, another
+app worker) publishes the IDs it touched to a Firestore collection, and every
+app process polls it to evict them.
+"""
+
+from firebase_admin import firestore
+
+INVALIDATIONS_COLLECTION = 'cache_invalidations'
+
+# Keep each invalidation document well below Firestore's document size limit
+MAX_IDS_PER_DOCUMENT = 500
+
+def _publish(db, field, ids):
+    ids = [str(id_) for id_ in dict.fromkeys(ids)]
+    if not ids:
+        return
+
+    batch = db.batch()
+    for start in range(0, len(ids), MAX_IDS_PER_DOCUMENT):
+        batch.set(db.collection(INVALIDATIONS_COLLECTION).document(), {
+            field: ids[start:start + MAX_IDS_PER_DOCUMENT],
+            'created_at': firestore.SERVER_TIMESTAMP
+        })
+    batch.commit()
+
+def publish_recipe_invalidations(db, recipe_ids):
+    """Record that the given recipes changed so app processes evict them"""
+    _publish(db, 'recipe_ids', recipe_ids)
+
+def publish_user_invalidations(db, user_ids):
+    """Record that the given user profiles changed so app processes evict them"""
+    _publish(db, 'user_ids', user_ids)
+
+def fetch_invalidations(db, since):
+    """Return (recipe_ids, user_ids, newest_created_at) for invalidations published after since"""
+    query = db.collection(INVALIDATIONS_COLLECTION).where('created_at', '>', since).order_by('created_at')
+
+    recipe_ids = []
+    user_ids = []
+    newest = since
+    for doc in query.stream():
+        data = doc.to_dict()
+        recipe_ids.extend(data.get('recipe_ids', []))
+        user_ids.extend(data.get('user_ids', []))
+        if data.get('created_at') is not None:
+            newest = max(newest, data['created_at'])
+    return recipe_ids, user_ids, newest
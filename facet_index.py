@@ -0,0 +1,152 @@
+"""
+Bitmap facet index for combined recipe filtering.
+
+Every recipe gets a dense ordinal, and each facet value (diet flag, dish type,
+cook time bucket) keeps a bitset over those ordinals. A combination of filters
+is then a handful of bitwise ANDs/ORs, and facet counts are popcounts of the
+result intersected with each facet bitset.
+"""
+
+import threading
+from bisect import bisect_left
+
+DIET_FACETS = ('vegetarian', 'vegan', 'glutenFree', 'dairyFree')
+
+# Upper bounds (in minutes) of the cook time buckets; the last bucket is open-ended
+TIME_BUCKETS = (15, 30, 45, 60, 75, 90, 105, 120)
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+def cook_minutes(ready_in_minutes):
+    try:
+        return int(ready_in_minutes or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def time_bucket(ready_in_minutes):
+    """Return the index of the cook time bucket for a recipe"""
+    return bisect_left(TIME_BUCKETS, cook_minutes(ready_in_minutes))
+
+class RecipeFacetIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids = []            # ordinal -> recipe ID (None for freed ordinals)
+        self._minutes = []        # ordinal -> readyInMinutes, for max_time inside a bucket
+        self._ordinals = {}       # recipe ID -> ordinal
+        self._free_ordinals = []  # ordinals of removed recipes, reused first
+        self._live = 0            # bitset of ordinals holding a recipe
+        self._diets = {diet: 0 for diet in DIET_FACETS}
+        self._dish_types = {}
+        self._time_buckets = [0] * (len(TIME_BUCKETS) + 1)
+
+    def __len__(self):
+        return len(self._ordinals)
+
+    def add_recipe(self, recipe):
+        """Index a recipe document, replacing any previous version"""
+        recipe_id = str(recipe.get('id', ''))
+        if not recipe_id:
+            return
+
+        with self._lock:
+            self._remove_locked(recipe_id)
+            if self._free_ordinals:
+                ordinal = self._free_ordinals.pop()
+                self._ids[ordinal] = recipe_id
+                self._minutes[ordinal] = cook_minutes(recipe.get('readyInMinutes'))
+            else:
+                ordinal = len(self._ids)
+                self._ids.append(recipe_id)
+                self._minutes.append(cook_minutes(recipe.get('readyInMinutes')))
+            self._ordinals[recipe_id] = ordinal
+
+            bit = 1 << ordinal
+            self._live |= bit
+            for diet in DIET_FACETS:
+                if recipe.get(diet):
+                    self._diets[diet] |= bit
+            for dish_type in set(t.lower() for t in recipe.get('dishTypes') or [] if t):
+                self._dish_types[dish_type] = self._dish_types.get(dish_type, 0) | bit
+            self._time_buckets[time_bucket(recipe.get('readyInMinutes'))] |= bit
+
+    def remove_recipe(self, recipe_id):
+        with self._lock:
+            self._remove_locked(str(recipe_id))
+
+    def _remove_locked(self, recipe_id):
+        ordinal = self._ordinals.pop(recipe_id, None)
+        if ordinal is None:
+            return
+
+        mask = ~(1 << ordinal)
+        self._live &= mask
+        for diet in DIET_FACETS:
+            self._diets[diet] &= mask
+        for dish_type in list(self._dish_types):
+            self._dish_types[dish_type] &= mask
+            if not self._dish_types[dish_type]:
+                del self._dish_types[dish_type]
+        for index in range(len(self._time_buckets)):
+            self._time_buckets[index] &= mask
+        self._ids[ordinal] = None
+        self._free_ordinals.append(ordinal)
+
+    def _match_locked(self, diets=(), meal_types=(), max_time=None):
+        bits = self._live
+        for diet in diets:
+            bits &= self._diets.get(diet, 0)
+
+        # Meal types match if the recipe has any of them
+        if meal_types:
+            any_meal_type = 0
+            for meal_type in meal_types:
+                any_meal_type |= self._dish_types.get(meal_type.lower(), 0)
+            bits &= any_meal_type
+
+        if max_time is not None:
+            within_time = 0
+            for index, upper_bound in enumerate(TIME_BUCKETS):
+                if upper_bound <= max_time:
+                    within_time |= self._time_buckets[index]
+
+            # The bucket max_time falls inside is checked recipe by recipe, matching readyInMinutes <= max_time
+            boundary = time_bucket(max_time)
+            if boundary == len(TIME_BUCKETS) or TIME_BUCKETS[boundary] > max_time:
+                candidates = bits & self._time_buckets[boundary]
+                while candidates:
+                    lowest = candidates & -candidates
+                    candidates ^= lowest
+                    if self._minutes[lowest.bit_length() - 1] <= max_time:
+                        within_time |= lowest
+            bits &= within_time
+
+        return bits
+
+    def _ids_for_bits(self, bits, offset, limit):
+        ids = []
+        position = 0
+        while bits and len(ids) < limit:
+            # Pop the lowest set bit
+            lowest = bits & -bits
+            bits ^= lowest
+            if position >= offset:
+                ids.append(self._ids[lowest.bit_length() - 1])
+            position += 1
+        return ids
+
+    def query(self, diets=(), meal_types=(), max_time=None, offset=0, limit=20):
+        """Filter recipes, returning (total_matches, page_of_recipe_ids, facet_counts)"""
+        with self._lock:
+            bits = self._match_locked(diets, meal_types, max_time)
+            counts = {
+                'diets': {diet: popcount(bits & self._diets[diet]) for diet in DIET_FACETS},
+                'dishTypes': {dish_type: popcount(bits & dish_bits)
+                              for dish_type, dish_bits in self._dish_types.items() if bits & dish_bits},
+                'readyInMinutes': {
+                    str(upper_bound): popcount(bits & self._time_buckets[index])
+                    for index, upper_bound in enumerate(TIME_BUCKETS)
+                }
+            }
+            counts['readyInMinutes']['more'] = popcount(bits & self._time_buckets[-1])
+            return popcount(bits), self._ids_for_bits(bits, offset, limit), counts
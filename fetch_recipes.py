@@ -6,22 +6,33 @@ A simple command line tool to fetch recipes from Spoonacular API
 and store them in Firebase Firestore.
 
 Usage:
-  python fetch_recipes.py [--count COUNT]
+  python fetch_recipes.py [--count COUNT] [--workers N] [--requests-per-second RATE]
+  python fetch_recipes.py --replay
 
 Options:
-  --count COUNT   Number of recipes to fetch (default: 30)
+  --count COUNT                 Number of recipes to fetch (default: 30)
+  --workers N                   Concurrent API requests (default: 4)
+  --requests-per-second RATE    Spoonacular request rate limit (default: 1)
+  --replay                      Re-store every recipe in the local response cache
+                                without calling the API
 """
 
 import argparse
 import os
 import sys
-from import_recipes import main as import_main
+from import_recipes import main as import_main, replay_cached_recipes
 
 def parse_args():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(description='Fetch recipes from Spoonacular API')
     parser.add_argument('--count', type=int, default=30,
                         help='Number of recipes to fetch (default: 30)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Concurrent API requests (default: 4)')
+    parser.add_argument('--requests-per-second', type=float, default=1.0,
+                        help='Spoonacular request rate limit for your plan (default: 1)')
+    parser.add_argument('--replay', action='store_true',
+                        help='Re-sanitize and store cached API responses without calling the API')
     return parser.parse_args()
 
 if __name__ == "__main__":
@@ -30,6 +41,14 @@ if __name__ == "__main__":
     
     # Set the recipe count environment variable
     os.environ['RECIPE_COUNT'] = str(args.count)
+    os.environ['IMPORT_WORKERS'] = str(args.workers)
+    os.environ['SPOONACULAR_REQUESTS_PER_SECOND'] = str(args.requests_per_second)
+    
+    if args.replay:
+        print("Replaying cached Spoonacular responses...")
+        replay_cached_recipes()
+        print("Replay completed. Check recipe_import.log for details.")
+        sys.exit(0)
     
     print(f"Starting recipe import process. Requesting {args.count} recipes...")
     
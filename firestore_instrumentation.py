@@ -0,0 +1,188 @@
+"""
+Instrumentation of Firestore client calls.
+
+The read, query and write methods of the Firestore client classes are wrapped
+once per process, and every call is reported to the registered listeners as
+a FirestoreCall. Calls made by another instrumented call (e.g. the batch
+commit behind DocumentReference.set) are reported only once, as the outer call.
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import namedtuple
+from google.cloud.firestore_v1.batch import WriteBatch
+from google.cloud.firestore_v1.client import Client
+from google.cloud.firestore_v1.document import DocumentReference
+from google.cloud.firestore_v1.query import Query
+from google.cloud.firestore_v1.transaction import Transaction
+
+try:
+    from google.cloud.firestore_v1.aggregation import AggregationQuery
+except ImportError:  # google-cloud-firestore < 2.9 has no aggregation queries
+    AggregationQuery = None
+
+# kind is one of 'read', 'query', 'aggregation' or 'write'; documents counts those returned or written
+# call_site is "file:line in function" of the calling app code, set only while capture_call_sites is on
+FirestoreCall = namedtuple('FirestoreCall', ['operation', 'kind', 'collection', 'duration', 'documents', 'call_site'])
+
+# Finding call sites walks the stack, so it is opt-in (used by the profiler)
+capture_call_sites = False
+
+_listeners = []
+_state = threading.local()
+_installed = False
+_install_lock = threading.Lock()
+
+def add_listener(listener):
+    """Call listener(FirestoreCall) for every Firestore call, installing the instrumentation if needed"""
+    install()
+    _listeners.append(listener)
+
+def _emit(operation, kind, collection, duration, documents, call_site):
+    call = FirestoreCall(operation, kind, collection, duration, documents, call_site)
+    for listener in _listeners:
+        try:
+            listener(call)
+        except Exception:
+            pass  # Instrumentation must never break the call itself
+
+# .../google, holding the Firestore client and the API core libraries it calls through
+_GOOGLE_PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(sys.modules[Query.__module__].__file__)))
+
+def _call_site():
+    """Return the innermost caller outside this module and the Google client libraries"""
+    if not capture_call_sites:
+        return None
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename != __file__ and not filename.startswith(_GOOGLE_PACKAGE_DIR):
+            return f"{os.path.basename(filename)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+def _nested():
+    return getattr(_state, 'depth', 0) > 0
+
+class _Outermost:
+    """Marks the current thread as inside an instrumented call"""
+    def __enter__(self):
+        _state.depth = getattr(_state, 'depth', 0) + 1
+
+    def __exit__(self, *exc):
+        _state.depth -= 1
+
+def _collection_of_document(reference):
+    path = getattr(reference, '_path', ())
+    return path[-2] if len(path) >= 2 else None
+
+def _collection_of_query(query):
+    parent = getattr(query, '_parent', None)
+    return getattr(parent, 'id', None)
+
+def _wrap_call(cls, name, operation, kind, get_collection, count_documents):
+    original = getattr(cls, name)
+
+    def wrapper(self, *args, **kwargs):
+        if _nested():
+            return original(self, *args, **kwargs)
+        call_site = _call_site()
+        start = time.perf_counter()
+        documents = 0
+        try:
+            with _Outermost():
+                result = original(self, *args, **kwargs)
+            documents = count_documents(self, result)
+            return result
+        finally:
+            _emit(operation, kind, get_collection(self, args), time.perf_counter() - start, documents, call_site)
+
+    wrapper.__wrapped__ = original
+    setattr(cls, name, wrapper)
+
+def _wrap_stream(cls, name, operation, kind, get_collection):
+    """Wrap a method returning a lazy iterator; the call is reported once the iterator is done"""
+    original = getattr(cls, name)
+
+    def wrapper(self, *args, **kwargs):
+        if _nested():
+            return original(self, *args, **kwargs)
+        collection = get_collection(self, args)
+        call_site = _call_site()
+        with _Outermost():
+            iterator = original(self, *args, **kwargs)
+        return _measured(iterator, operation, kind, collection, call_site)
+
+    wrapper.__wrapped__ = original
+    setattr(cls, name, wrapper)
+
+def _measured(iterator, operation, kind, collection, call_site):
+    duration = 0.0
+    documents = 0
+    try:
+        iterator = iter(iterator)
+        while True:
+            # Only time spent fetching counts, not time spent by the consumer
+            start = time.perf_counter()
+            try:
+                with _Outermost():
+                    item = next(iterator)
+            except StopIteration:
+                duration += time.perf_counter() - start
+                return
+            duration += time.perf_counter() - start
+            documents += 1
+            yield item
+    finally:
+        _emit(operation, kind, collection, duration, documents, call_site)
+
+def _existing(snapshot):
+    return 1 if getattr(snapshot, 'exists', False) else 0
+
+def install():
+    """Wrap the Firestore client classes; safe to call more than once"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        _installed = True
+
+        def document_collection(reference, args):
+            return _collection_of_document(reference)
+
+        def query_collection(query, args):
+            return _collection_of_query(query)
+
+        def get_all_collection(client, args):
+            references = list(args[0]) if args and isinstance(args[0], (list, tuple)) else []
+            return _collection_of_document(references[0]) if references else None
+
+        def no_documents(target, result):
+            return 0
+
+        def one_document(target, result):
+            return 1
+
+        def committed_writes(batch, write_results):
+            return len(write_results or ())
+
+        _wrap_call(DocumentReference, 'get', 'get', 'read', document_collection,
+                   lambda reference, snapshot: _existing(snapshot))
+        for name in ('set', 'update', 'delete', 'create'):
+            _wrap_call(DocumentReference, name, name, 'write', document_collection, one_document)
+
+        _wrap_stream(Query, 'stream', 'query', 'query', query_collection)
+        _wrap_call(Query, 'get', 'query', 'query', query_collection, lambda query, result: len(result))
+        _wrap_stream(Client, 'get_all', 'get_all', 'read', get_all_collection)
+
+        _wrap_call(WriteBatch, 'commit', 'batch_commit', 'write', lambda batch, args: None, committed_writes)
+        if hasattr(Transaction, '_commit'):
+            _wrap_call(Transaction, '_commit', 'transaction_commit', 'write', lambda transaction, args: None,
+                       committed_writes)
+
+        if AggregationQuery is not None:
+            _wrap_call(AggregationQuery, 'get', 'count', 'aggregation',
+                       lambda aggregation, args: _collection_of_query(getattr(aggregation, '_nested_query', None)),
+                       no_documents)
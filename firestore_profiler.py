@@ -0,0 +1,189 @@
+"""
+Opt-in per-request Firestore profiler.
+
+Set FIRESTORE_PROFILE=1 to record every Firestore call a request makes, with
+its collection, operation, latency and the app code that made it. Repeated
+single-document reads from one collection are flagged as likely N+1 patterns,
+and requests slower than FIRESTORE_PROFILE_SLOW_MS get a JSON report and an
+HTML summary written to FIRESTORE_PROFILE_DIR.
+"""
+
+import os
+import json
+import html
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import defaultdict
+from datetime import datetime, timezone
+import firestore_instrumentation
+
+logger = logging.getLogger("firestore_profiler")
+
+ENABLED = os.environ.get('FIRESTORE_PROFILE', '').lower() in ('1', 'true', 'on')
+SLOW_REQUEST_SECONDS = float(os.environ.get('FIRESTORE_PROFILE_SLOW_MS', 500)) / 1000
+REPORT_DIR = os.environ.get('FIRESTORE_PROFILE_DIR', 'firestore_profiles')
+
+# This many single-document reads from one collection in one request look like a loop
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('FIRESTORE_PROFILE_N_PLUS_ONE', 5))
+
+class RequestProfile:
+    def __init__(self, method, path, endpoint):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.endpoint = endpoint
+        self.started_at = datetime.now(timezone.utc)
+        self.calls = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, call):
+        offset = time.perf_counter() - self._start - call.duration
+        with self._lock:
+            self.calls.append(dict(call._asdict(), offset=round(max(offset, 0.0), 6)))
+
+    def n_plus_one_patterns(self):
+        """Return collections read one document at a time at least N_PLUS_ONE_THRESHOLD times"""
+        reads = defaultdict(list)
+        for call in self.calls:
+            if call['operation'] == 'get' and call['collection']:
+                reads[call['collection']].append(call)
+
+        patterns = []
+        for collection, calls in reads.items():
+            if len(calls) >= N_PLUS_ONE_THRESHOLD:
+                call_sites = defaultdict(int)
+                for call in calls:
+                    call_sites[call['call_site'] or 'unknown'] += 1
+                patterns.append({
+                    'collection': collection,
+                    'reads': len(calls),
+                    'total_seconds': round(sum(call['duration'] for call in calls), 6),
+                    'call_sites': dict(sorted(call_sites.items(), key=lambda item: -item[1]))
+                })
+        return sorted(patterns, key=lambda pattern: -pattern['reads'])
+
+    def to_dict(self, duration, status):
+        calls_by_collection = defaultdict(lambda: {'calls': 0, 'documents': 0, 'seconds': 0.0})
+        for call in self.calls:
+            totals = calls_by_collection[f"{call['collection'] or '-'} {call['operation']}"]
+            totals['calls'] += 1
+            totals['documents'] += call['documents']
+            totals['seconds'] = round(totals['seconds'] + call['duration'], 6)
+
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'endpoint': self.endpoint,
+            'status': status,
+            'started_at': self.started_at.isoformat(),
+            'duration_seconds': round(duration, 6),
+            'firestore_calls': len(self.calls),
+            'firestore_seconds': round(sum(call['duration'] for call in self.calls), 6),
+            'firestore_documents': sum(call['documents'] for call in self.calls),
+            'n_plus_one': self.n_plus_one_patterns(),
+            'by_collection': dict(calls_by_collection),
+            'calls': sorted(self.calls, key=lambda call: call['offset'])
+        }
+
+current_profile = contextvars.ContextVar('current_profile', default=None)
+
+def record_call(call):
+    profile = current_profile.get()
+    if profile is not None:
+        profile.add(call)
+
+if ENABLED:
+    firestore_instrumentation.capture_call_sites = True
+    firestore_instrumentation.add_listener(record_call)
+
+def start_request(method, path, endpoint):
+    """Begin profiling a request, returning a handle for finish_request (None when profiling is off)"""
+    if not ENABLED:
+        return None
+    profile = RequestProfile(method, path, endpoint)
+    return current_profile.set(profile), profile
+
+def finish_request(handle, status):
+    if handle is None:
+        return
+    token, profile = handle
+    try:
+        current_profile.reset(token)
+    except ValueError:
+        pass  # Finished in a different context than it started in; nothing to restore
+
+    duration = time.perf_counter() - profile._start
+    patterns = profile.n_plus_one_patterns()
+    for pattern in patterns:
+        logger.warning(f"Possible N+1 in {profile.method} {profile.path}: {pattern['reads']} single reads "
+                       f"from '{pattern['collection']}' ({', '.join(pattern['call_sites'])})")
+
+    if duration >= SLOW_REQUEST_SECONDS:
+        try:
+            path = write_report(profile.to_dict(duration, status))
+            logger.info(f"Slow request {profile.method} {profile.path} took {duration * 1000:.0f}ms "
+                        f"with {len(profile.calls)} Firestore calls, report: {path}")
+        except Exception as e:
+            logger.error(f"Could not write Firestore profile report: {str(e)}")
+
+def write_report(report):
+    """Write a request's JSON report and HTML summary, returning the JSON path"""
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    name = f"{report['started_at'][:19].replace(':', '')}-{report['endpoint']}-{report['id']}"
+    json_path = os.path.join(REPORT_DIR, f"{name}.json")
+    with open(json_path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    with open(os.path.join(REPORT_DIR, f"{name}.html"), 'w') as f:
+        f.write(render_html(report))
+    return json_path
+
+def render_html(report):
+    escape = html.escape
+    n_plus_one_rows = ''.join(
+        f"<tr><td>{escape(pattern['collection'])}</td><td>{pattern['reads']}</td>"
+        f"<td>{pattern['total_seconds'] * 1000:.1f}</td>"
+        f"<td>{'<br>'.join(f'{escape(site)} &times; {count}' for site, count in pattern['call_sites'].items())}</td></tr>"
+        for pattern in report['n_plus_one']
+    ) or '<tr><td colspan="4">None detected</td></tr>'
+    collection_rows = ''.join(
+        f"<tr><td>{escape(key)}</td><td>{totals['calls']}</td><td>{totals['documents']}</td>"
+        f"<td>{totals['seconds'] * 1000:.1f}</td></tr>"
+        for key, totals in sorted(report['by_collection'].items(), key=lambda item: -item[1]['seconds'])
+    )
+    call_rows = ''.join(
+        f"<tr><td>{call['offset'] * 1000:.1f}</td><td>{call['duration'] * 1000:.1f}</td>"
+        f"<td>{escape(call['operation'])}</td><td>{escape(call['collection'] or '-')}</td>"
+        f"<td>{call['documents']}</td><td>{escape(call['call_site'] or '')}</td></tr>"
+        for call in report['calls']
+    )
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{escape(report['method'])} {escape(report['path'])} - Firestore profile</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; margin-bottom: 2em; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 8px; text-align: left; vertical-align: top; }}
+th {{ background: #f4f4f4; }}
+</style>
+</head>
+<body>
+<h1>{escape(report['method'])} {escape(report['path'])}</h1>
+<p>Status {report['status']} &middot; {report['duration_seconds'] * 1000:.1f} ms total &middot;
+{report['firestore_calls']} Firestore calls ({report['firestore_seconds'] * 1000:.1f} ms,
+{report['firestore_documents']} documents) &middot; {escape(report['started_at'])}</p>
+<h2>Possible N+1 patterns</h2>
+<table><tr><th>Collection</th><th>Reads</th><th>ms</th><th>Call sites</th></tr>{n_plus_one_rows}</table>
+<h2>By collection</h2>
+<table><tr><th>Collection / operation</th><th>Calls</th><th>Documents</th><th>ms</th></tr>{collection_rows}</table>
+<h2>Calls</h2>
+<table><tr><th>Start (ms)</th><th>Duration (ms)</th><th>Operation</th><th>Collection</th><th>Documents</th><th>Call site</th></tr>{call_rows}</table>
+</body>
+</html>
+"""
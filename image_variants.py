@@ -0,0 +1,61 @@
+"""
+Resized WebP and JPEG renditions of recipe images.
+
+Listing pages only need small card images, so the photo migrator stores a
+card-sized and a detail-sized rendition of each recipe image in both WebP and
+JPEG, and records their storage paths and dimensions on the recipe document.
+"""
+
+import io
+from PIL import Image, ImageOps
+
+# Bounding box (width, height) of each variant; images are never upscaled
+IMAGE_VARIANTS = {
+    'card': (480, 480),
+    'detail': (1200, 1200)
+}
+
+# Encoder settings for each output format
+VARIANT_FORMATS = {
+    'webp': {'format': 'WEBP', 'content_type': 'image/webp', 'options': {'quality': 80, 'method': 4}},
+    'jpeg': {'format': 'JPEG', 'content_type': 'image/jpeg', 'options': {'quality': 82, 'optimize': True, 'progressive': True}}
+}
+
+FILE_EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/webp': 'webp',
+    'image/gif': 'gif'
+}
+
+def file_extension(content_type):
+    """Return the file extension for an image content type"""
+    return FILE_EXTENSIONS.get((content_type or '').split(';')[0].strip().lower(), 'jpg')
+
+def build_variants(image_data):
+    """Resize image bytes into every variant and format.
+
+    Returns a dict of variant name -> {'width', 'height', 'renditions'}, where
+    renditions maps a format name to (bytes, content_type).
+    """
+    with Image.open(io.BytesIO(image_data)) as image:
+        # Apply camera rotation and flatten transparency/palettes for JPEG
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+        variants = {}
+        for name, box in IMAGE_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail(box, Image.LANCZOS)
+
+            renditions = {}
+            for format_name, settings in VARIANT_FORMATS.items():
+                output = io.BytesIO()
+                resized.save(output, settings['format'], **settings['options'])
+                renditions[format_name] = (output.getvalue(), settings['content_type'])
+
+            variants[name] = {'width': resized.width, 'height': resized.height, 'renditions': renditions}
+        return variants
+
+def variant_storage_path(storage_folder, doc_id, variant_name, format_name):
+    extension = 'jpg' if format_name == 'jpeg' else format_name
+    return f"{storage_folder}/{doc_id}/{variant_name}.{extension}"
@@ -1,21 +1,23 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core import exceptions as google_exceptions
 from dotenv import load_dotenv
 import time
 import logging
+from logging_setup import configure_logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from cache_invalidation import publish_recipe_invalidations
+from spoonacular_cache import ResponseCache, is_random_request
+from recipe_cards import RECIPE_CARDS_COLLECTION, build_recipe_card, recipe_card_ref
 
 # Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("recipe_import.log"),
-        logging.StreamHandler()
-    ]
-)
+configure_logging("recipe_import.log")
 logger = logging.getLogger("recipe_importer")
 
 # Load environment variables
@@ -32,56 +34,223 @@ db = firestore.client()
 
 SPOONACULAR_API_KEY = os.getenv('SPOONACULAR_API_KEY')
 
+# Replaying cached responses works without a key, so only API access requires one
 if not SPOONACULAR_API_KEY:
-    logger.error("Spoonacular API key not found in environment variables")
-    raise ValueError("API key not found. Please set SPOONACULAR_API_KEY in .env")
+    logger.warning("Spoonacular API key not found in environment variables")
+
+SPOONACULAR_BASE_URL = "https://api.spoonacular.com/recipes"
+
+# complexSearch returns at most 100 results per page and cannot skip past 900
+SEARCH_PAGE_SIZE = 100
+MAX_SEARCH_OFFSET = 900
+
+# Largest number of IDs requested in one informationBulk call
+BULK_CHUNK_SIZE = 100
+
+DEFAULT_IMPORT_WORKERS = 4
+DEFAULT_REQUESTS_PER_SECOND = 1.0  # Spoonacular free tier
+MAX_RETRIES = 5
+
+# Each search is capped at 1000 results, so larger imports walk through these
+# partitions of the catalog, one complexSearch query each
+SEARCH_PARTITIONS = [{"type": meal_type} for meal_type in (
+    "main course", "side dish", "dessert", "appetizer", "salad", "bread", "breakfast",
+    "soup", "beverage", "sauce", "marinade", "fingerfood", "snack", "drink"
+)] + [{"cuisine": cuisine} for cuisine in (
+    "african", "american", "british", "cajun", "caribbean", "chinese", "eastern european",
+    "european", "french", "german", "greek", "indian", "irish", "italian", "japanese",
+    "jewish", "korean", "latin american", "mediterranean", "mexican", "middle eastern",
+    "nordic", "southern", "spanish", "thai", "vietnamese"
+)]
+
+class QuotaExhaustedError(Exception):
+    """Raised when the daily Spoonacular point quota is used up"""
+
+class QuotaTokenBucket:
+    """Token bucket limiting the request rate, with a point budget read from Spoonacular's quota headers"""
+    def __init__(self, requests_per_second, burst=1):
+        self.rate = requests_per_second
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.quota_left = None   # points left today, from X-API-Quota-Left
+        self.request_costs = {}  # endpoint -> points its last request cost, from X-API-Quota-Request
+        self.lock = threading.Lock()
+    
+    def acquire(self, endpoint):
+        """Block until a request to endpoint may be sent"""
+        while True:
+            with self.lock:
+                if self.quota_left is not None and self.quota_left < self.request_costs.get(endpoint, 1):
+                    raise QuotaExhaustedError(f"Spoonacular quota exhausted ({self.quota_left:.2f} points left)")
+                
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+    
+    def update(self, endpoint, headers):
+        """Record the quota headers of a response"""
+        with self.lock:
+            try:
+                if 'X-API-Quota-Left' in headers:
+                    self.quota_left = float(headers['X-API-Quota-Left'])
+                if 'X-API-Quota-Request' in headers:
+                    self.request_costs[endpoint] = float(headers['X-API-Quota-Request'])
+            except ValueError:
+                logger.debug(f"Ignoring malformed quota headers for {endpoint}")
+    
+    def pause(self, seconds):
+        """Hold off all requests for a while, e.g. after a 429"""
+        with self.lock:
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+class SpoonacularClient:
+    """Pooled, retrying and rate limited access to the Spoonacular API"""
+    def __init__(self, api_key=None, workers=DEFAULT_IMPORT_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                 cache=None):
+        self.api_key = api_key or SPOONACULAR_API_KEY
+        if not self.api_key:
+            logger.error("Spoonacular API key not found in environment variables")
+            raise ValueError("API key not found. Please set SPOONACULAR_API_KEY in .env")
+        self.workers = workers
+        self.cache = cache
+        self.limiter = QuotaTokenBucket(requests_per_second, burst=workers)
+        
+        # Retry connection errors and server errors with exponential backoff
+        retry = Retry(total=MAX_RETRIES, backoff_factor=1, status_forcelist=[500, 502, 503, 504],
+                      allowed_methods=["GET"], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+    
+    def get(self, endpoint, params):
+        """GET an API endpoint, returning the decoded JSON"""
+        # Random results must stay random, so those are recorded but never served from the cache
+        cacheable = self.cache is not None and not is_random_request(endpoint, params)
+        if cacheable:
+            payload = self.cache.get(endpoint, params)
+            if payload is not None:
+                return payload
+        
+        payload = self._fetch(endpoint, params)
+        if self.cache is not None:
+            self.cache.put(endpoint, params, payload)
+        return payload
+    
+    def _fetch(self, endpoint, params):
+        for attempt in range(MAX_RETRIES + 1):
+            self.limiter.acquire(endpoint)
+            response = self.session.get(f"{SPOONACULAR_BASE_URL}/{endpoint}",
+                                        params=dict(params, apiKey=self.api_key), timeout=30)
+            self.limiter.update(endpoint, response.headers)
+            
+            if response.status_code == 402:
+                raise QuotaExhaustedError("Spoonacular daily quota exhausted")
+            if response.status_code == 429 and attempt < MAX_RETRIES:
+                # Rate limited; back everyone off, honouring Retry-After when given
+                try:
+                    delay = float(response.headers.get('Retry-After', 2 ** attempt))
+                except ValueError:
+                    delay = 2 ** attempt
+                logger.warning(f"Rate limited by Spoonacular on {endpoint}, backing off {delay:.1f}s")
+                self.limiter.pause(delay)
+                continue
+            
+            response.raise_for_status()
+            return response.json()
+    
+    @classmethod
+    def from_env(cls):
+        return cls(workers=int(os.environ.get('IMPORT_WORKERS', DEFAULT_IMPORT_WORKERS)),
+                   requests_per_second=float(os.environ.get('SPOONACULAR_REQUESTS_PER_SECOND',
+                                                            DEFAULT_REQUESTS_PER_SECOND)),
+                   cache=ResponseCache.from_env())
 
-def fetch_recipe_ids(count=30):
-    """Fetch recipe IDs from Spoonacular"""
+def search_recipe_ids(client, partition, offset, number):
+    """Return (total_results, recipe_ids) for one complexSearch page"""
+    params = dict(partition, number=number, offset=offset, instructionsRequired=True)
+    # Random order only makes sense for a single page; offsets need a stable order
+    params["sort"] = "random" if partition.get("sort") == "random" else "popularity"
+    data = client.get("complexSearch", params)
+    return data.get('totalResults', 0), [recipe['id'] for recipe in data.get('results', [])]
+
+def fetch_recipe_ids(count=30, client=None):
+    """Fetch recipe IDs from Spoonacular, paging through complexSearch"""
     logger.info(f"Fetching {count} recipe IDs from Spoonacular API")
-    url = "https://api.spoonacular.com/recipes/complexSearch"
-    params = {
-        "apiKey": SPOONACULAR_API_KEY,
-        "number": count,
-        "addRecipeInformation": True,
-        "fillIngredients": True,
-        "instructionsRequired": True,
-        "sort": "random"  # Get random recipes each time
-    }
+    client = client or SpoonacularClient.from_env()
+    
+    # A single page keeps the old behaviour of random recipes on every run
+    partitions = [{"sort": "random"}] if count <= SEARCH_PAGE_SIZE else SEARCH_PARTITIONS
+    recipe_ids = {}
     
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        results = response.json().get('results', [])
-        logger.info(f"Successfully fetched {len(results)} recipe IDs")
-        return [recipe['id'] for recipe in results]
+        with ThreadPoolExecutor(max_workers=client.workers) as executor:
+            for partition in partitions:
+                known = len(recipe_ids)
+                needed = count - known
+                if needed <= 0:
+                    break
+                
+                # The first page tells us how many results the partition has
+                total, ids = search_recipe_ids(client, partition, 0, min(SEARCH_PAGE_SIZE, needed))
+                recipe_ids.update(dict.fromkeys(ids))
+                
+                # Over-fetch by the IDs earlier partitions returned, which this one may repeat
+                last_offset = min(total, MAX_SEARCH_OFFSET + SEARCH_PAGE_SIZE, needed + known)
+                futures = [
+                    executor.submit(search_recipe_ids, client, partition, offset, SEARCH_PAGE_SIZE)
+                    for offset in range(SEARCH_PAGE_SIZE, last_offset, SEARCH_PAGE_SIZE)
+                ]
+                for future in futures:
+                    try:
+                        _, ids = future.result()
+                        recipe_ids.update(dict.fromkeys(ids))
+                    except requests.exceptions.RequestException as e:
+                        logger.error(f"Error fetching recipe IDs for {partition}: {str(e)}")
+    except QuotaExhaustedError as e:
+        logger.error(f"Stopped fetching recipe IDs: {str(e)}")
     except requests.exceptions.RequestException as e:
         logger.error(f"Error fetching recipe IDs: {str(e)}")
-        return []
+    
+    recipe_ids = list(recipe_ids)[:count]
+    logger.info(f"Successfully fetched {len(recipe_ids)} recipe IDs")
+    return recipe_ids
+
+def fetch_recipe_chunk(client, recipe_ids):
+    return client.get("informationBulk", {"ids": ",".join(map(str, recipe_ids)), "includeNutrition": True})
 
-def fetch_recipe_details(recipe_ids):
+def iter_recipe_details(recipe_ids, client=None):
+    """Fetch bulk recipe details in concurrent chunks, yielding each chunk's recipes as it arrives"""
+    client = client or SpoonacularClient.from_env()
+    chunks = [recipe_ids[i:i + BULK_CHUNK_SIZE] for i in range(0, len(recipe_ids), BULK_CHUNK_SIZE)]
+    
+    with ThreadPoolExecutor(max_workers=client.workers) as executor:
+        futures = {executor.submit(fetch_recipe_chunk, client, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except QuotaExhaustedError as e:
+                logger.error(f"Skipping {len(futures[future])} recipes: {str(e)}")
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error fetching details for {len(futures[future])} recipes: {str(e)}")
+
+def fetch_recipe_details(recipe_ids, client=None):
     """Fetch bulk recipe details"""
     if not recipe_ids:
         logger.warning("No recipe IDs provided to fetch details")
         return []
         
     logger.info(f"Fetching details for {len(recipe_ids)} recipes")
-    url = "https://api.spoonacular.com/recipes/informationBulk"
-    params = {
-        "apiKey": SPOONACULAR_API_KEY,
-        "ids": ",".join(map(str, recipe_ids)),
-        "includeNutrition": True
-    }
-
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        recipes = response.json()
-        logger.info(f"Successfully fetched details for {len(recipes)} recipes")
-        return recipes
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching recipe details: {str(e)}")
-        return []
+    recipes = []
+    for chunk in iter_recipe_details(recipe_ids, client):
+        recipes.extend(chunk)
+    logger.info(f"Successfully fetched details for {len(recipes)} recipes")
+    return recipes
 
 def sanitize_recipe(recipe):
     """Convert Spoonacular data to Firestore-friendly format"""
@@ -133,44 +302,173 @@ def sanitize_recipe(recipe):
             'importedAt': firestore.SERVER_TIMESTAMP
         }
 
-def store_recipes(recipes):
-    """Store recipes in Firestore with duplicate check"""
+# Firestore limits: 100 documents per get_all request we send, 500 writes per batch
+GET_ALL_CHUNK_SIZE = 100
+WRITE_CHUNK_SIZE = 500
+# Each recipe write also writes its card
+RECIPES_PER_CHUNK = WRITE_CHUNK_SIZE // 2
+WRITE_WORKERS = 4
+WRITE_RETRIES = 3
+
+RETRYABLE_WRITE_EXCEPTIONS = (
+    google_exceptions.Aborted,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable
+)
+
+def find_existing_recipe_ids(recipe_ids, collection_name='recipes'):
+    """Return the subset of recipe IDs already stored in Firestore (or with a document in collection_name)"""
+    recipes_ref = db.collection(collection_name)
+    recipe_ids = [str(recipe_id) for recipe_id in dict.fromkeys(recipe_ids)]
+    existing_ids = set()
+    
+    for start in range(0, len(recipe_ids), GET_ALL_CHUNK_SIZE):
+        chunk = recipe_ids[start:start + GET_ALL_CHUNK_SIZE]
+        # Only existence matters, so skip transferring the recipe bodies
+        for doc in db.get_all([recipes_ref.document(recipe_id) for recipe_id in chunk], field_paths=['id']):
+            if doc.exists:
+                existing_ids.add(doc.id)
+    return existing_ids
+
+def commit_chunk(writes):
+    """Commit one chunk of (recipe_ref, data, merge, card) writes as a batch, retrying transient errors.
+
+    The recipe card is written alongside the recipe (merged into the existing card
+    with merge) unless it is None.
+    """
+    for attempt in range(WRITE_RETRIES + 1):
+        batch = db.batch()
+        for doc_ref, data, merge, card in writes:
+            batch.set(doc_ref, data, merge=merge)
+            if card is not None:
+                batch.set(recipe_card_ref(db, doc_ref.id), card, merge=merge)
+        try:
+            batch.commit()
+            return
+        except RETRYABLE_WRITE_EXCEPTIONS as e:
+            if attempt == WRITE_RETRIES:
+                raise
+            delay = 2 ** attempt
+            logger.warning(f"Retrying batch of {len(writes)} writes in {delay}s: {str(e)}")
+            time.sleep(delay)
+
+def write_documents(writes):
+    """Write (recipe_ref, data, merge, card) tuples in concurrent chunked batches.
+
+    Returns (written_ids, failed_ids).
+    """
+    chunks = [writes[i:i + RECIPES_PER_CHUNK] for i in range(0, len(writes), RECIPES_PER_CHUNK)]
+    written_ids = []
+    failed_ids = []
+    
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+        futures = {executor.submit(commit_chunk, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            chunk_ids = [doc_ref.id for doc_ref, _, _, _ in futures[future]]
+            try:
+                future.result()
+                written_ids.extend(chunk_ids)
+            except Exception as e:
+                logger.error(f"Failed to write {len(chunk_ids)} documents "
+                             f"({chunk_ids[0]}..{chunk_ids[-1]}): {str(e)}")
+                failed_ids.extend(chunk_ids)
+    
+    return written_ids, failed_ids
+
+# Fields of an existing recipe that a refresh must keep, e.g. the migrated Storage image URL
+PRESERVED_FIELDS = ('image',)
+
+def store_recipes(recipes, update_existing=False):
+    """Store recipes in Firestore with duplicate check, returning the IDs stored.
+
+    With update_existing, recipes already stored are re-sanitized and merged
+    into their documents instead of being skipped.
+    """
     if not recipes:
         logger.warning("No recipes provided to store")
-        return
+        return []
         
     logger.info(f"Preparing to store {len(recipes)} recipes")
-    batch = db.batch()
+    start_time = time.time()
     recipes_ref = db.collection('recipes')
     
-    # Track stored and skipped counts
-    stored_count = 0
+    # Track stored, updated and skipped counts
     skipped_count = 0
+    updated_count = 0
+    writes = []
+    
+    try:
+        existing_ids = find_existing_recipe_ids(recipe['id'] for recipe in recipes if 'id' in recipe)
+        # A refresh only carries part of a card (no image), so it may only update cards that exist;
+        # recipes stored before cards existed get theirs from backfill_recipe_cards.py
+        existing_card_ids = (find_existing_recipe_ids(existing_ids, RECIPE_CARDS_COLLECTION)
+                             if update_existing and existing_ids else set())
+    except Exception as e:
+        logger.error(f"Error checking for existing recipes: {str(e)}")
+        return []
     
+    seen_ids = set()
     for recipe in recipes:
         try:
             recipe_id = str(recipe['id'])
-            # Check if recipe exists
-            existing_doc = recipes_ref.document(recipe_id).get()
-            
-            if not existing_doc.exists:
+            if recipe_id in seen_ids:
+                skipped_count += 1
+            elif recipe_id not in existing_ids:
                 sanitized = sanitize_recipe(recipe)
-                batch.set(recipes_ref.document(recipe_id), sanitized)
-                stored_count += 1
+                writes.append((recipes_ref.document(recipe_id), sanitized, False, build_recipe_card(sanitized)))
+            elif update_existing:
+                # Merge so ratings, image variants and storage paths survive
+                sanitized = sanitize_recipe(recipe)
+                for field in PRESERVED_FIELDS:
+                    sanitized.pop(field, None)
+                sanitized['updatedAt'] = firestore.SERVER_TIMESTAMP
+                card = build_recipe_card(sanitized) if recipe_id in existing_card_ids else None
+                writes.append((recipes_ref.document(recipe_id), sanitized, True, card))
+                updated_count += 1
             else:
                 skipped_count += 1
                 logger.debug(f"Skipping duplicate recipe: {recipe_id}")
+            seen_ids.add(recipe_id)
         except Exception as e:
             logger.error(f"Error processing recipe {recipe.get('id', 'unknown')}: {str(e)}")
     
-    try:
-        if stored_count > 0:
-            batch.commit()
-            logger.info(f"Successfully stored {stored_count} recipes (skipped {skipped_count} duplicates)")
-        else:
-            logger.info(f"No new recipes to store (skipped {skipped_count} duplicates)")
-    except Exception as e:
-        logger.error(f"Error storing recipes in Firestore: {str(e)}")
+    if not writes:
+        logger.info(f"No new recipes to store (skipped {skipped_count} duplicates)")
+        return []
+    
+    stored_ids, failed_ids = write_documents(writes)
+    duration = time.time() - start_time
+    rate = len(stored_ids) / duration if duration > 0 else 0.0
+    logger.info(f"Successfully stored {len(stored_ids)} recipes in {duration:.2f}s ({rate:.1f} docs/sec, "
+                f"{updated_count} updates, skipped {skipped_count} duplicates, {len(failed_ids)} failed)")
+    
+    if stored_ids:
+        try:
+            # Let running app processes evict any cached copies
+            publish_recipe_invalidations(db, stored_ids)
+        except Exception as e:
+            logger.error(f"Error publishing cache invalidations: {str(e)}")
+    return stored_ids
+
+def replay_cached_recipes():
+    """Re-sanitize and store every recipe payload in the response cache, without any API calls"""
+    start_time = datetime.now()
+    cache = ResponseCache.from_env()
+    logger.info(f"Replaying cached Spoonacular responses from {cache.path}")
+    
+    recipes = list(cache.iter_recipes())
+    if not recipes:
+        logger.warning("No cached recipe payloads to replay")
+        return
+    
+    stored_count = 0
+    for start in range(0, len(recipes), WRITE_CHUNK_SIZE):
+        stored_count += len(store_recipes(recipes[start:start + WRITE_CHUNK_SIZE], update_existing=True))
+    
+    duration = (datetime.now() - start_time).total_seconds()
+    logger.info(f"Replayed {len(recipes)} cached recipes, {stored_count} written in {duration:.2f} seconds")
 
 def main():
     """Main function to run the recipe import process"""
@@ -182,17 +480,34 @@ def main():
     logger.info(f"Starting recipe import process at {start_time} for {recipe_count} recipes")
     
     try:
+        client = SpoonacularClient.from_env()
+        
         # Fetch and store recipes
-        recipe_ids = fetch_recipe_ids(recipe_count)
+        recipe_ids = fetch_recipe_ids(recipe_count, client)
         if recipe_ids:
-            # Add a delay to respect rate limits
-            time.sleep(1)  # Spoonacular free tier rate limiting
+            # Don't spend quota on details of recipes we already have
+            existing_ids = find_existing_recipe_ids(recipe_ids)
+            recipe_ids = [recipe_id for recipe_id in recipe_ids if str(recipe_id) not in existing_ids]
+            logger.info(f"{len(existing_ids)} recipes already stored, {len(recipe_ids)} new")
+            
+            # Store each chunk as it arrives so large imports never hold the whole catalog
+            logger.info(f"Fetching details for {len(recipe_ids)} recipes")
+            fetched_count = 0
+            stored_count = 0
+            for recipes_data in iter_recipe_details(recipe_ids, client):
+                fetched_count += len(recipes_data)
+                stored_count += len(store_recipes(recipes_data))
             
-            recipes_data = fetch_recipe_details(recipe_ids)
-            if recipes_data:
-                store_recipes(recipes_data)
+            if fetched_count:
+                logger.info(f"Successfully fetched details for {fetched_count} recipes")
             else:
                 logger.warning("No recipe details were retrieved")
+            elapsed = (datetime.now() - start_time).total_seconds()
+            logger.info(f"Stored {stored_count} new recipes overall "
+                        f"({stored_count / elapsed if elapsed > 0 else 0.0:.1f} docs/sec)")
+            logger.info(f"Response cache: {client.cache.hits} hits, {client.cache.misses} misses")
+            if client.limiter.quota_left is not None:
+                logger.info(f"Spoonacular quota left: {client.limiter.quota_left:.2f} points")
         else:
             logger.warning("No recipe IDs were retrieved")
     except Exception as e:
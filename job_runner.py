@@ -0,0 +1,146 @@
+"""
+Background jobs for long-running admin operations.
+
+Jobs run on a small thread pool, and their state is kept in the Firestore
+'jobs' collection, so any app worker can report on a job started by another
+and a finished job's result survives restarts. Request handlers enqueue a job
+and return its ID; clients poll /api/jobs/<id> for progress. A heartbeat keeps
+unfinished jobs fresh while their process is alive, so only jobs whose worker
+died are reported as interrupted.
+"""
+
+import os
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("jobs")
+
+JOBS_COLLECTION = 'jobs'
+
+# Write progress at most this often; the final state is always written
+PROGRESS_WRITE_INTERVAL = timedelta(seconds=1)
+
+# The runner refreshes updated_at of its queued and running jobs this often (in seconds)...
+HEARTBEAT_INTERVAL = 60
+
+# ...so a queued or running job not heard from for this long died with its worker process
+STALE_JOB_AFTER = timedelta(minutes=10)
+
+FINISHED_STATUSES = ('succeeded', 'failed', 'interrupted')
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+class Job:
+    """Handle passed to a job function for reporting progress"""
+    def __init__(self, doc_ref):
+        self.id = doc_ref.id
+        self._doc_ref = doc_ref
+        self._last_write = None
+        self._lock = threading.Lock()
+
+    def update(self, fields):
+        fields['updated_at'] = utcnow()
+        self._doc_ref.update(fields)
+
+    def progress(self, done, total=None, message=None):
+        """Report progress; writes are throttled so tight loops can call this freely"""
+        with self._lock:
+            now = utcnow()
+            if self._last_write is not None and now - self._last_write < PROGRESS_WRITE_INTERVAL:
+                return
+            self._last_write = now
+
+        fields = {'progress.done': done}
+        if total is not None:
+            fields['progress.total'] = total
+        if message is not None:
+            fields['message'] = message
+        self.update(fields)
+
+class JobRunner:
+    def __init__(self, db, max_workers=2):
+        self.db = db
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True).start()
+
+    def submit(self, job_type, func, *args, created_by=None, **kwargs):
+        """Record a new job and queue func(job, *args, **kwargs), returning the job ID"""
+        doc_ref = self.db.collection(JOBS_COLLECTION).document()
+        now = utcnow()
+        doc_ref.set({
+            'type': job_type,
+            'status': 'queued',
+            'progress': {'done': 0, 'total': None},
+            'message': None,
+            'result': None,
+            'error': None,
+            'created_by': created_by,
+            'worker': self.worker,
+            'created_at': now,
+            'updated_at': now
+        })
+        with self._pending_lock:
+            self._pending[doc_ref.id] = doc_ref
+        self._executor.submit(self._run, Job(doc_ref), job_type, func, args, kwargs)
+        return doc_ref.id
+
+    def _heartbeat(self):
+        """Keep updated_at of unfinished jobs fresh, including ones waiting for a free worker"""
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self._pending_lock:
+                doc_refs = list(self._pending.values())
+            # Firestore allows at most 500 writes per batch
+            for start in range(0, len(doc_refs), 500):
+                try:
+                    batch = self.db.batch()
+                    for doc_ref in doc_refs[start:start + 500]:
+                        batch.update(doc_ref, {'updated_at': utcnow()})
+                    batch.commit()
+                except Exception as e:
+                    logger.error(f"Could not record job heartbeat: {str(e)}")
+
+    def _run(self, job, job_type, func, args, kwargs):
+        try:
+            self._run_job(job, job_type, func, args, kwargs)
+        finally:
+            with self._pending_lock:
+                self._pending.pop(job.id, None)
+
+    def _run_job(self, job, job_type, func, args, kwargs):
+        try:
+            job.update({'status': 'running', 'started_at': utcnow()})
+            result = func(job, *args, **kwargs)
+            job.update({'status': 'succeeded', 'result': result, 'finished_at': utcnow()})
+            logger.info(f"Job {job.id} ({job_type}) succeeded")
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job_type}) failed: {str(e)}")
+            try:
+                job.update({'status': 'failed', 'error': str(e), 'finished_at': utcnow()})
+            except Exception as update_error:
+                logger.error(f"Could not record failure of job {job.id}: {str(update_error)}")
+
+    def get(self, job_id):
+        """Return a job's state as a JSON-friendly dict, or None if it does not exist"""
+        doc = self.db.collection(JOBS_COLLECTION).document(job_id).get()
+        if not doc.exists:
+            return None
+
+        job = doc.to_dict()
+        updated_at = job.get('updated_at')
+        if job.get('status') not in FINISHED_STATUSES and updated_at and utcnow() - updated_at > STALE_JOB_AFTER:
+            job['status'] = 'interrupted'
+
+        job['id'] = doc.id
+        for field in ('created_at', 'updated_at', 'started_at', 'finished_at'):
+            if isinstance(job.get(field), datetime):
+                job[field] = job[field].isoformat()
+        return job
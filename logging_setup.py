@@ -0,0 +1,130 @@
+"""
+Shared logging setup for the app and the command line scripts.
+
+Log calls only put the record on an in-memory queue. A background listener
+thread writes it to the console and, as JSON lines, to a size-rotated log
+file, so the request path never waits on file I/O. Chatty loggers can be
+sampled: LOG_SAMPLE_RATES="werkzeug=0.1,app=0.5" keeps that fraction of their
+records below WARNING.
+"""
+
+import os
+import json
+import copy
+import queue
+import atexit
+import random
+import logging
+import traceback
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+CONSOLE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+# Records beyond this many waiting to be written are dropped rather than blocking the caller
+QUEUE_SIZE = 10000
+
+# LogRecord attributes that are not user-supplied extra fields
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON objects"""
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of each listed logger's records below WARNING"""
+    def __init__(self, rates):
+        super().__init__()
+        # Longest prefix first, so 'app.jobs' overrides 'app'
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + '.'):
+                return random.random() < rate
+        return True
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler that drops records instead of blocking when the writer falls behind"""
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+    def prepare(self, record):
+        # Resolve the message and traceback now; the listener may format much later
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+def parse_sample_rates(spec):
+    """Parse "logger=rate,..." into a dict, ignoring malformed entries"""
+    rates = {}
+    for item in (spec or '').split(','):
+        name, _, rate = item.partition('=')
+        try:
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            continue
+    return {name: rate for name, rate in rates.items() if name}
+
+def configure_logging(log_file, level=None):
+    """Route all logging through a background writer; later calls are ignored"""
+    global _listener
+    if _listener is not None:
+        return
+
+    file_handler = RotatingFileHandler(
+        log_file,
+        maxBytes=int(os.environ.get('LOG_MAX_BYTES', DEFAULT_MAX_BYTES)),
+        backupCount=int(os.environ.get('LOG_BACKUP_COUNT', DEFAULT_BACKUP_COUNT))
+    )
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+
+    log_queue = queue.Queue(QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    sample_rates = parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES'))
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level or os.environ.get('LOG_LEVEL', 'INFO').upper())
+
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(_listener.stop)
@@ -0,0 +1,89 @@
+"""
+Prometheus metrics for the web app.
+
+Requests are timed per endpoint, and every Firestore call is counted against
+the endpoint of the request that made it (or 'background' for worker
+threads), so per-page read volume shows up next to latency on /metrics.
+"""
+
+import threading
+import contextvars
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+import firestore_instrumentation
+
+REGISTRY = CollectorRegistry()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+PER_REQUEST_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000, 5000)
+
+REQUEST_LATENCY = Histogram('recipehub_http_request_duration_seconds', 'Request latency by endpoint',
+                            ['endpoint', 'method'], buckets=LATENCY_BUCKETS, registry=REGISTRY)
+REQUESTS = Counter('recipehub_http_requests_total', 'Requests by endpoint and status',
+                   ['endpoint', 'method', 'status'], registry=REGISTRY)
+RESPONSE_SIZE = Histogram('recipehub_http_response_size_bytes', 'Response body size by endpoint',
+                          ['endpoint'], buckets=SIZE_BUCKETS, registry=REGISTRY)
+
+FIRESTORE_OPERATIONS = Counter('recipehub_firestore_operations_total', 'Firestore calls by endpoint',
+                               ['endpoint', 'kind', 'collection'], registry=REGISTRY)
+FIRESTORE_DOCUMENTS = Counter('recipehub_firestore_documents_total', 'Firestore documents returned or written',
+                              ['endpoint', 'kind', 'collection'], registry=REGISTRY)
+FIRESTORE_LATENCY = Histogram('recipehub_firestore_operation_duration_seconds', 'Firestore call latency',
+                              ['kind'], buckets=LATENCY_BUCKETS, registry=REGISTRY)
+REQUEST_FIRESTORE_OPERATIONS = Histogram('recipehub_request_firestore_operations',
+                                         'Firestore calls made by a single request', ['endpoint'],
+                                         buckets=PER_REQUEST_BUCKETS, registry=REGISTRY)
+REQUEST_FIRESTORE_DOCUMENTS = Histogram('recipehub_request_firestore_documents',
+                                        'Firestore documents read or written by a single request', ['endpoint'],
+                                        buckets=PER_REQUEST_BUCKETS, registry=REGISTRY)
+
+class RequestStats:
+    """Firestore totals for one request, shared with the lookup threads it fans out to"""
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.operations = 0
+        self.documents = 0
+        self._lock = threading.Lock()
+
+    def add(self, documents):
+        with self._lock:
+            self.operations += 1
+            self.documents += documents
+
+current_request = contextvars.ContextVar('current_request', default=None)
+
+def record_firestore_call(call):
+    stats = current_request.get()
+    endpoint = stats.endpoint if stats else 'background'
+    collection = call.collection or ''
+
+    FIRESTORE_OPERATIONS.labels(endpoint, call.kind, collection).inc()
+    FIRESTORE_DOCUMENTS.labels(endpoint, call.kind, collection).inc(call.documents)
+    FIRESTORE_LATENCY.labels(call.kind).observe(call.duration)
+    if stats:
+        stats.add(call.documents)
+
+firestore_instrumentation.add_listener(record_firestore_call)
+
+def start_request(endpoint):
+    """Begin tracking a request, returning a handle for finish_request"""
+    stats = RequestStats(endpoint)
+    return current_request.set(stats), stats
+
+def finish_request(handle, method, status, duration, response_size=None):
+    token, stats = handle
+    try:
+        current_request.reset(token)
+    except ValueError:
+        pass  # Finished in a different context than it started in; nothing to restore
+
+    REQUEST_LATENCY.labels(stats.endpoint, method).observe(duration)
+    REQUESTS.labels(stats.endpoint, method, str(status)).inc()
+    if response_size is not None:
+        RESPONSE_SIZE.labels(stats.endpoint).observe(response_size)
+    REQUEST_FIRESTORE_OPERATIONS.labels(stats.endpoint).observe(stats.operations)
+    REQUEST_FIRESTORE_DOCUMENTS.labels(stats.endpoint).observe(stats.documents)
+
+def render_metrics():
+    """Return (body, content_type) in the Prometheus text format"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -8,31 +8,56 @@ to Firebase Storage. It handles:
 2. Review photos uploaded by users
 3. User profile photos
 
+Recipe images are also resized into card and detail variants in WebP and JPEG
+(see image_variants.py); reprocess_images.py regenerates them for recipes that
+were already migrated.
+
 Usage:
-    python migrate_photos.py
+    python migrate_photos.py [--download-workers N] [--upload-workers N] [--update-workers N]
+                             [--resume] [--dry-run] [--checkpoint PATH] [--hash-index PATH]
+
+Each photo goes through three stages (download, upload to Storage, Firestore
+update). Stages run on a shared worker pool and each one has its own
+concurrency limit, so slow downloads do not starve uploads or vice versa.
+
+Collections are read page by page in document ID order. After every page the
+last document ID and the counters are written to a local checkpoint file, so
+--resume continues an interrupted run where it stopped. --dry-run reports how
+much work is left without downloading or writing anything.
+
+Downloaded images are hashed, and a local SQLite index maps each content hash
+(and source URL) to the blob it was stored as. Duplicate images point at the
+existing blob instead of being uploaded and made public again.
 
 Requirements:
-    pip install firebase-admin requests tqdm
+    pip install firebase-admin requests tqdm Pillow
 """
 
 import os
+import json
+import sqlite3
+import hashlib
+import argparse
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 import firebase_admin
 from firebase_admin import credentials, firestore, storage
 from urllib.parse import urlparse
 import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import logging
+from logging_setup import configure_logging
+from google.api_core import exceptions as google_exceptions
+from google.cloud.firestore_v1.field_path import FieldPath
+from cache_invalidation import publish_recipe_invalidations
+from image_variants import build_variants, file_extension, variant_storage_path
+from recipe_cards import build_recipe_card, recipe_card_ref
 
 # Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("photo_migration.log"),
-        logging.StreamHandler()
-    ]
-)
+configure_logging("photo_migration.log")
 logger = logging.getLogger("photo_migration")
 
 # Initialize Firebase
@@ -53,214 +78,657 @@ def is_firebase_storage_url(url):
     if not url:
         return False
     parsed = urlparse(url)
-    return 'firebasestorage.googleapis.com' in parsed.netloc
+    if 'firebasestorage.googleapis.com' in parsed.netloc:
+        return True
+    # Public URLs of blobs uploaded by this script point at the bucket directly
+    return parsed.netloc == 'storage.googleapis.com' and parsed.path.startswith(f"/{bucket.name}/")
+
+# Documents read per page when walking a collection
+PAGE_SIZE = 200
+
+DEFAULT_CHECKPOINT_PATH = 'photo_migration_checkpoint.json'
+DEFAULT_HASH_INDEX_PATH = 'photo_hashes.sqlite3'
+
+# Longest a worker waits for another worker's upload of the same image (seconds)
+CLAIM_WAIT_TIMEOUT = 300
+
+class ContentHashIndex:
+    """Maps image content hashes and source URLs to blobs already in Storage.
+
+    Blobs can be deleted after they were recorded (e.g. by a cascading recipe
+    delete), so every hit is checked with blob_exists(storage_path) and a
+    missing blob is forgotten and uploaded again.
+    """
+    def __init__(self, path, blob_exists=None):
+        self.blob_exists = blob_exists
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                content_hash TEXT PRIMARY KEY,
+                storage_path TEXT NOT NULL,
+                url TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                variants TEXT
+            );
+            CREATE TABLE IF NOT EXISTS source_urls (
+                url TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL
+            );
+        """)
+        self._lock = threading.Lock()
+        self._pending = {}  # content hash -> Event set once its first upload finishes
+        self.duplicates = 0
+        self.storage_bytes_saved = 0
+        self.upload_bytes_saved = 0
+        self.download_bytes_saved = 0
+    
+    def _lookup(self, content_hash):
+        row = self._conn.execute(
+            "SELECT storage_path, url, size, variants FROM blobs WHERE content_hash = ?", (content_hash,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'content_hash': content_hash,
+            'storage_path': row[0],
+            'url': row[1],
+            'size': row[2],
+            'variants': json.loads(row[3]) if row[3] else None
+        }
+    
+    def _still_stored(self, entry):
+        """Return whether an entry's blob exists, forgetting the entry if it does not"""
+        if self.blob_exists is None or self.blob_exists(entry['storage_path']):
+            return True
+        logger.info(f"Blob {entry['storage_path']} was deleted, uploading its image again")
+        with self._lock:
+            # Unless another worker has already stored the image again
+            deleted = self._conn.execute("DELETE FROM blobs WHERE content_hash = ? AND storage_path = ?",
+                                         (entry['content_hash'], entry['storage_path'])).rowcount
+            if deleted:
+                self._conn.execute("DELETE FROM source_urls WHERE content_hash = ?", (entry['content_hash'],))
+            self._conn.commit()
+        return False
+    
+    def lookup_url(self, source_url):
+        """Return the stored blob for a source URL seen before, or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT content_hash FROM source_urls WHERE url = ?", (source_url,)).fetchone()
+            entry = self._lookup(row[0]) if row else None
+        return entry if entry is not None and self._still_stored(entry) else None
+    
+    def claim(self, content_hash):
+        """Return the stored blob for a hash, or None if the caller should upload it.
+
+        Concurrent callers with the same hash wait for the first upload to finish,
+        raising TimeoutError after CLAIM_WAIT_TIMEOUT. A successful claim must end
+        in record() or release().
+        """
+        while True:
+            with self._lock:
+                entry = self._lookup(content_hash)
+                event = self._pending.get(content_hash) if entry is None else None
+                if entry is None and event is None:
+                    self._pending[content_hash] = threading.Event()
+                    return None
+            if entry is not None:
+                if self._still_stored(entry):
+                    return entry
+                continue
+            if not event.wait(CLAIM_WAIT_TIMEOUT):
+                raise TimeoutError(f"Timed out waiting for another upload of image {content_hash[:12]}")
+    
+    def record(self, content_hash, source_url, storage_path, url, size, variants=None):
+        """Store the blob uploaded for a claimed hash"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blobs (content_hash, storage_path, url, size, variants) VALUES (?, ?, ?, ?, ?)",
+                (content_hash, storage_path, url, size, json.dumps(variants) if variants else None)
+            )
+            self._conn.execute("INSERT OR REPLACE INTO source_urls (url, content_hash) VALUES (?, ?)",
+                               (source_url, content_hash))
+            self._conn.commit()
+            event = self._pending.pop(content_hash, None)
+        if event:
+            event.set()
+    
+    def release(self, content_hash):
+        """Give up a claim so another caller can retry it; a no-op once the hash is recorded"""
+        with self._lock:
+            event = self._pending.pop(content_hash, None)
+        if event:
+            event.set()
+    
+    def record_duplicate(self, entry, source_url, downloaded):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO source_urls (url, content_hash) VALUES (?, ?)",
+                               (source_url, entry['content_hash']))
+            self._conn.commit()
+            self.duplicates += 1
+            self.storage_bytes_saved += entry['size']
+            self.upload_bytes_saved += entry['size']
+            if not downloaded:
+                self.download_bytes_saved += entry['size']
+    
+    def report(self):
+        mb = 1024 * 1024
+        return (f"{self.duplicates} duplicate images reused, "
+                f"{self.storage_bytes_saved / mb:.2f} MB storage saved, "
+                f"{(self.upload_bytes_saved + self.download_bytes_saved) / mb:.2f} MB bandwidth saved "
+                f"({self.upload_bytes_saved / mb:.2f} MB upload, {self.download_bytes_saved / mb:.2f} MB download)")
+
+class MigrationCheckpoint:
+    """Per-collection progress of a migration run, kept in a local JSON file"""
+    def __init__(self, path, state=None):
+        self.path = path
+        self.state = state or {}
+    
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path) as f:
+            return cls(path, json.load(f))
+    
+    def progress(self, collection_name):
+        return self.state.setdefault(collection_name, {
+            'last_doc_id': None,
+            'migrated': 0,
+            'skipped': 0,
+            'failed': 0,
+            'done': False
+        })
+    
+    def save(self):
+        # Write to a temporary file first so a crash never leaves a truncated checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+def page_query(collection, start_after_id=None, field_paths=None):
+    """Build the query for one page of documents in document ID order after start_after_id"""
+    document_id = FieldPath.document_id()
+    query = collection.order_by(document_id).limit(PAGE_SIZE)
+    if field_paths is not None:
+        query = query.select(field_paths)
+    if start_after_id:
+        query = query.start_after({document_id: collection.document(start_after_id)})
+    return query
+
+def remaining_query(collection, start_after_id=None):
+    """Build the aggregation query counting the documents after start_after_id"""
+    query = collection
+    if start_after_id:
+        query = collection.where(FieldPath.document_id(), '>', collection.document(start_after_id))
+    return query.count()
+
+def iter_pages(collection_name, start_after_id=None, field_paths=None):
+    """Yield pages of documents in document ID order, starting after start_after_id"""
+    collection = db.collection(collection_name)
+    
+    while True:
+        page = list(page_query(collection, start_after_id, field_paths).stream())
+        if not page:
+            return
+        yield page
+        start_after_id = page[-1].id
+
+def count_remaining(collection_name, start_after_id=None):
+    """Count the documents after start_after_id with an aggregation query"""
+    return int(remaining_query(db.collection(collection_name), start_after_id).get()[0][0].value)
+
+# Default concurrency of each pipeline stage
+DEFAULT_DOWNLOAD_WORKERS = 8
+DEFAULT_UPLOAD_WORKERS = 4
+DEFAULT_UPDATE_WORKERS = 4
+DEFAULT_PROCESS_WORKERS = os.cpu_count() or 2
 
-def download_image(url):
+# Retries for throttled or temporarily unavailable calls
+MAX_RETRIES = 5
+
+# Errors from Google APIs that mean "slow down and try again"
+THROTTLE_EXCEPTIONS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.ResourceExhausted
+)
+
+class ThrottledError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdaptiveRateLimiter:
+    """Spaces out calls to a remote service, backing off when it throttles us"""
+    def __init__(self, name, min_interval=0.0, max_interval=30.0):
+        self.name = name
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+    
+    def on_success(self):
+        # Recover gradually once calls succeed again
+        with self._lock:
+            self.interval = max(self.min_interval, self.interval * 0.9 - 0.001)
+    
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            self.interval = min(self.max_interval, max(self.interval * 2, 0.1, retry_after or 0))
+            self._next_slot = time.monotonic() + self.interval
+        logger.warning(f"{self.name} is throttling requests, spacing calls {self.interval:.2f}s apart")
+
+class StageStats:
+    """Items, bytes and busy time recorded for one pipeline stage"""
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+    
+    def record(self, seconds, num_bytes=0):
+        with self._lock:
+            self.items += 1
+            self.bytes += num_bytes
+            self.busy_seconds += seconds
+    
+    def summary(self, wall_seconds):
+        wall_seconds = max(wall_seconds, 0.001)
+        line = f"{self.name}: {self.items} items, {self.items / wall_seconds:.2f} items/s"
+        if self.bytes:
+            line += f", {self.bytes / 1024 / 1024 / wall_seconds:.2f} MB/s"
+        if self.items:
+            line += f", {self.busy_seconds / self.items * 1000:.0f} ms avg"
+        return line
+
+class MigrationPipeline:
+    """Shared HTTP session, per-stage concurrency limits, rate limiters and stats"""
+    def __init__(self, download_workers=DEFAULT_DOWNLOAD_WORKERS, upload_workers=DEFAULT_UPLOAD_WORKERS,
+                 update_workers=DEFAULT_UPDATE_WORKERS, process_workers=DEFAULT_PROCESS_WORKERS, hash_index=None):
+        self.hash_index = hash_index
+        self.workers = download_workers + process_workers + upload_workers + update_workers
+        self.slots = {
+            'download': threading.BoundedSemaphore(download_workers),
+            'process': threading.BoundedSemaphore(process_workers),
+            'upload': threading.BoundedSemaphore(upload_workers),
+            'update': threading.BoundedSemaphore(update_workers)
+        }
+        self.limiters = {
+            'download': AdaptiveRateLimiter('Image host'),
+            'process': AdaptiveRateLimiter('Image processing'),
+            'upload': AdaptiveRateLimiter('Firebase Storage'),
+            'update': AdaptiveRateLimiter('Firestore')
+        }
+        self.stats = {stage: StageStats(stage) for stage in self.slots}
+        
+        # Pooled HTTP session sized for the download concurrency
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=download_workers, pool_maxsize=download_workers)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+    
+    def run_stage(self, stage, func, *args, num_bytes=None):
+        """Run one stage call under its concurrency limit, retrying when throttled"""
+        limiter = self.limiters[stage]
+        with self.slots[stage]:
+            for attempt in range(MAX_RETRIES + 1):
+                limiter.wait()
+                started = time.monotonic()
+                try:
+                    result = func(*args)
+                except (ThrottledError,) + THROTTLE_EXCEPTIONS as e:
+                    if attempt == MAX_RETRIES:
+                        raise
+                    limiter.on_throttle(getattr(e, 'retry_after', None))
+                    continue
+                limiter.on_success()
+                size = num_bytes(result) if num_bytes else 0
+                self.stats[stage].record(time.monotonic() - started, size)
+                return result
+    
+    def report(self, wall_seconds):
+        return [self.stats[stage].summary(wall_seconds) for stage in self.slots]
+
+def fetch_image(http, url):
+    response = http.get(url, timeout=30)
+    if response.status_code in (429, 503):
+        retry_after = response.headers.get('Retry-After')
+        raise ThrottledError(f"HTTP {response.status_code} from {url}",
+                             float(retry_after) if retry_after and retry_after.isdigit() else None)
+    response.raise_for_status()
+    return response.content, response.headers.get('content-type', 'image/jpeg')
+
+def download_image(url, pipeline=None):
     """Download image from URL"""
+    pipeline = pipeline or MigrationPipeline()
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        return response.content, response.headers.get('content-type', 'image/jpeg')
+        return pipeline.run_stage('download', fetch_image, pipeline.http, url, num_bytes=lambda result: len(result[0]))
     except Exception as e:
         logger.error(f"Failed to download image from {url}: {str(e)}")
         return None, None
 
-def migrate_recipe_photos():
-    """Migrate recipe photos from external URLs to Firebase Storage"""
-    logger.info("Starting recipe photo migration...")
+def upload_image(storage_path, image_data, content_type):
+    """Upload image bytes to Firebase Storage and return the public URL"""
+    blob = bucket.blob(storage_path)
+    blob.upload_from_string(image_data, content_type=content_type)
     
-    # Get all recipes with image URLs
-    recipes_ref = db.collection('recipes').stream()
-    recipes = list(recipes_ref)  # Convert to list for progress bar
+    # Make it publicly accessible
+    blob.make_public()
+    return blob.public_url
+
+def upload_variants(storage_folder, doc_id, image_data, pipeline):
+    """Build and upload the resized variants of an image, returning (image_variants, bytes_uploaded)"""
+    variants = pipeline.run_stage('process', build_variants, image_data)
     
-    migrated = 0
-    skipped = 0
-    failed = 0
+    image_variants = {}
+    bytes_uploaded = 0
+    for variant_name, variant in variants.items():
+        image_variants[variant_name] = {'width': variant['width'], 'height': variant['height']}
+        for format_name, (data, content_type) in variant['renditions'].items():
+            storage_path = variant_storage_path(storage_folder, doc_id, variant_name, format_name)
+            url = pipeline.run_stage('upload', upload_image, storage_path, data, content_type,
+                                     num_bytes=lambda _, size=len(data): size)
+            image_variants[variant_name][format_name] = {'path': storage_path, 'url': url}
+            bytes_uploaded += len(data)
+    return image_variants, bytes_uploaded
+
+def store_image(doc_id, storage_folder, label, image_data, content_type, pipeline, make_variants):
+    """Upload a new image (and its variants), returning the stored blob entry"""
+    # Upload to Firebase Storage, named after the real image format
+    storage_path = f"{storage_folder}/{doc_id}.{file_extension(content_type)}"
+    new_url = pipeline.run_stage('upload', upload_image, storage_path, image_data, content_type,
+                                 num_bytes=lambda _: len(image_data))
+    entry = {'storage_path': storage_path, 'url': new_url, 'size': len(image_data), 'variants': None}
     
-    for doc in tqdm(recipes, desc="Migrating recipe photos"):
-        recipe = doc.to_dict()
-        recipe_id = recipe.get('id')
-        image_url = recipe.get('image')
-        
-        if not image_url or not recipe_id:
-            skipped += 1
-            continue
-            
-        # Skip if already a Firebase Storage URL
-        if is_firebase_storage_url(image_url):
-            logger.info(f"Recipe {recipe_id} already using Firebase Storage, skipping")
-            skipped += 1
-            continue
-        
-        # Download the image
-        image_data, content_type = download_image(image_url)
-        if not image_data:
-            failed += 1
-            continue
-        
+    if make_variants:
         try:
-            # Upload to Firebase Storage
-            storage_path = f"recipe_images/{recipe_id}.jpg"
-            blob = bucket.blob(storage_path)
-            blob.upload_from_string(image_data, content_type=content_type)
-            
-            # Make it publicly accessible
-            blob.make_public()
-            new_url = blob.public_url
-            
-            # Update Firestore document
-            db.collection('recipes').document(recipe_id).update({
-                'image': new_url,
-                'storage_path': storage_path  # Store the storage path for future reference
-            })
-            
-            logger.info(f"Successfully migrated image for recipe {recipe_id}")
-            migrated += 1
-            
-            # Respect API rate limits with a small delay
-            time.sleep(0.1)
-            
+            entry['variants'], variant_bytes = upload_variants(storage_folder, doc_id, image_data, pipeline)
+            entry['size'] += variant_bytes
         except Exception as e:
-            logger.error(f"Failed to migrate image for recipe {recipe_id}: {str(e)}")
-            failed += 1
+            # The original is still usable without variants
+            logger.warning(f"Could not build image variants for {label.lower()} {doc_id}: {str(e)}")
     
-    logger.info(f"Recipe photo migration complete. Migrated: {migrated}, Skipped: {skipped}, Failed: {failed}")
-    return migrated, skipped, failed
+    return entry
 
-def migrate_review_photos():
-    """Migrate review photos uploaded by users"""
-    logger.info("Starting review photo migration...")
+def update_recipe(recipe_id, update):
+    """Update a recipe and the matching fields of its recipe card, if it has one"""
+    db.collection('recipes').document(recipe_id).update(update)
+    try:
+        # Never create a card from a partial update; backfill_recipe_cards.py writes missing ones
+        recipe_card_ref(db, recipe_id).update(build_recipe_card(update))
+    except google_exceptions.NotFound:
+        pass
+
+def migrate_document(doc, collection_name, url_field, storage_folder, label, pipeline, make_variants=False):
+    """Move one document's photo to Firebase Storage, returning 'migrated', 'skipped' or 'failed'"""
+    data = doc.to_dict()
+    doc_id = doc.id
+    photo_url = data.get(url_field)
+    hash_index = pipeline.hash_index
     
-    # Get all reviews with photo URLs
-    reviews_ref = db.collection('reviews').stream()
-    reviews = list(reviews_ref)
+    if not photo_url:
+        return 'skipped'
     
-    migrated = 0
-    skipped = 0
-    failed = 0
+    # Skip if already a Firebase Storage URL
+    if is_firebase_storage_url(photo_url):
+        logger.info(f"{label} {doc_id} already using Firebase Storage, skipping")
+        return 'skipped'
     
-    for doc in tqdm(reviews, desc="Migrating review photos"):
-        review_data = doc.to_dict()
-        review_id = doc.id
-        photo_url = review_data.get('photo_url')
-        
-        if not photo_url:
-            skipped += 1
-            continue
+    try:
+        # A source URL stored before needs neither a download nor an upload
+        entry = hash_index.lookup_url(photo_url) if hash_index else None
+        if entry is not None:
+            hash_index.record_duplicate(entry, photo_url, downloaded=False)
+        else:
+            # Download the image
+            image_data, content_type = download_image(photo_url, pipeline)
+            if not image_data:
+                return 'failed'
             
-        # Skip if already a Firebase Storage URL
-        if is_firebase_storage_url(photo_url):
-            logger.info(f"Review {review_id} photo already using Firebase Storage, skipping")
-            skipped += 1
-            continue
+            content_hash = hashlib.sha256(image_data).hexdigest()
+            entry = hash_index.claim(content_hash) if hash_index else None
+            if entry is not None:
+                hash_index.record_duplicate(entry, photo_url, downloaded=True)
+            else:
+                try:
+                    entry = store_image(doc_id, storage_folder, label, image_data, content_type, pipeline, make_variants)
+                    if hash_index:
+                        hash_index.record(content_hash, photo_url, entry['storage_path'], entry['url'],
+                                          entry['size'], entry['variants'])
+                finally:
+                    # Wakes up workers waiting on this hash however the upload or record ended
+                    if hash_index:
+                        hash_index.release(content_hash)
         
-        # Download the image
-        image_data, content_type = download_image(photo_url)
-        if not image_data:
-            failed += 1
-            continue
+        # Update Firestore document
+        update = {
+            url_field: entry['url'],
+            'storage_path': entry['storage_path']  # Store the storage path for future reference
+        }
+        if make_variants and entry['variants']:
+            update['image_variants'] = entry['variants']
+        if collection_name == 'recipes':
+            update['updatedAt'] = firestore.SERVER_TIMESTAMP  # Changes the recipe page ETag
+            pipeline.run_stage('update', update_recipe, doc_id, update)
+        else:
+            pipeline.run_stage('update', db.collection(collection_name).document(doc_id).update, update)
         
-        try:
-            # Upload to Firebase Storage
-            storage_path = f"review_photos/{review_id}.jpg"
-            blob = bucket.blob(storage_path)
-            blob.upload_from_string(image_data, content_type=content_type)
-            
-            # Make it publicly accessible
-            blob.make_public()
-            new_url = blob.public_url
-            
-            # Update Firestore document
-            db.collection('reviews').document(review_id).update({
-                'photo_url': new_url,
-                'storage_path': storage_path
-            })
-            
-            logger.info(f"Successfully migrated photo for review {review_id}")
-            migrated += 1
-            
-            # Respect API rate limits
-            time.sleep(0.1)
-            
-        except Exception as e:
-            logger.error(f"Failed to migrate photo for review {review_id}: {str(e)}")
-            failed += 1
+        logger.info(f"Successfully migrated photo for {label.lower()} {doc_id}")
+        return 'migrated'
     
-    logger.info(f"Review photo migration complete. Migrated: {migrated}, Skipped: {skipped}, Failed: {failed}")
-    return migrated, skipped, failed
+    except Exception as e:
+        logger.error(f"Failed to migrate photo for {label.lower()} {doc_id}: {str(e)}")
+        return 'failed'
 
-def migrate_user_profile_photos():
-    """Migrate user profile photos"""
-    logger.info("Starting user profile photo migration...")
+def reprocess_recipe_document(doc, pipeline, force=False):
+    """Regenerate the image variants of an already migrated recipe"""
+    data = doc.to_dict()
+    storage_path = data.get('storage_path')
     
-    # Get all users with profile photos
-    users_ref = db.collection('users').stream()
-    users = list(users_ref)
+    if not storage_path or (data.get('image_variants') and not force):
+        return 'skipped'
     
-    migrated = 0
-    skipped = 0
-    failed = 0
+    try:
+        # Read the original back from our own bucket
+        image_data = pipeline.run_stage('download', bucket.blob(storage_path).download_as_bytes,
+                                        num_bytes=len)
+        image_variants, _ = upload_variants('recipe_images', doc.id, image_data, pipeline)
+        pipeline.run_stage('update', update_recipe, doc.id, {
+            'image_variants': image_variants,
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        })
+        logger.info(f"Regenerated image variants for recipe {doc.id}")
+        return 'migrated'
     
-    for doc in tqdm(users, desc="Migrating profile photos"):
-        user_data = doc.to_dict()
-        user_id = doc.id
-        photo_url = user_data.get('photo_url')
-        
-        if not photo_url:
-            skipped += 1
-            continue
-            
-        # Skip if already a Firebase Storage URL
-        if is_firebase_storage_url(photo_url):
-            logger.info(f"User {user_id} profile photo already using Firebase Storage, skipping")
-            skipped += 1
-            continue
-        
-        # Download the image
-        image_data, content_type = download_image(photo_url)
-        if not image_data:
-            failed += 1
-            continue
-        
-        try:
-            # Upload to Firebase Storage
-            storage_path = f"profile_photos/{user_id}.jpg"
-            blob = bucket.blob(storage_path)
-            blob.upload_from_string(image_data, content_type=content_type)
-            
-            # Make it publicly accessible
-            blob.make_public()
-            new_url = blob.public_url
-            
-            # Update Firestore document
-            db.collection('users').document(user_id).update({
-                'photo_url': new_url,
-                'storage_path': storage_path
-            })
+    except Exception as e:
+        logger.error(f"Failed to regenerate image variants for recipe {doc.id}: {str(e)}")
+        return 'failed'
+
+def migrate_collection(collection_name, label, process_document, pipeline, checkpoint=None, on_page_migrated=None):
+    """Stream one collection through the worker pool, checkpointing after every page
+
+    process_document(doc) handles a single document and returns 'migrated',
+    'skipped' or 'failed'.
+    """
+    checkpoint = checkpoint or MigrationCheckpoint(DEFAULT_CHECKPOINT_PATH)
+    progress = checkpoint.progress(collection_name)
+    
+    if progress['done']:
+        logger.info(f"{label} photo migration already complete in checkpoint, skipping")
+        return progress['migrated'], progress['skipped'], progress['failed']
+    
+    if progress['last_doc_id']:
+        logger.info(f"Resuming {label.lower()} photo migration after document {progress['last_doc_id']}")
+    
+    total = count_remaining(collection_name, progress['last_doc_id'])
+    
+    with ThreadPoolExecutor(max_workers=pipeline.workers) as executor, \
+            tqdm(total=total, desc=f"Migrating {label.lower()} photos") as progress_bar:
+        for page in iter_pages(collection_name, progress['last_doc_id']):
+            futures = {
+                executor.submit(process_document, doc): doc.id
+                for doc in page
+            }
+            migrated_ids = []
+            for future in as_completed(futures):
+                outcome = future.result()
+                progress[outcome] += 1
+                if outcome == 'migrated':
+                    migrated_ids.append(futures[future])
+                progress_bar.update(1)
             
-            logger.info(f"Successfully migrated photo for user {user_id}")
-            migrated += 1
+            if on_page_migrated and migrated_ids:
+                on_page_migrated(migrated_ids)
             
-        except Exception as e:
-            logger.error(f"Failed to migrate photo for user {user_id}: {str(e)}")
-            failed += 1
+            # Every document up to the end of this page has been handled
+            progress['last_doc_id'] = page[-1].id
+            checkpoint.save()
+    
+    progress['done'] = True
+    checkpoint.save()
+    return progress['migrated'], progress['skipped'], progress['failed']
+
+def estimate_collection(collection_name, url_field, label, checkpoint):
+    """Count the documents and photos left to migrate without changing anything"""
+    progress = checkpoint.progress(collection_name)
+    if progress['done']:
+        return 0, 0
+    
+    remaining_docs = 0
+    remaining_photos = 0
+    for page in iter_pages(collection_name, progress['last_doc_id'], field_paths=[url_field]):
+        remaining_docs += len(page)
+        for doc in page:
+            photo_url = doc.to_dict().get(url_field)
+            if photo_url and not is_firebase_storage_url(photo_url):
+                remaining_photos += 1
     
+    logger.info(f"{label} photos: {remaining_docs} documents left to scan, {remaining_photos} photos to migrate")
+    return remaining_docs, remaining_photos
+
+def migrate_recipe_photos(pipeline=None, checkpoint=None):
+    """Migrate recipe photos from external URLs to Firebase Storage"""
+    logger.info("Starting recipe photo migration...")
+    pipeline = pipeline or MigrationPipeline()
+    migrated, skipped, failed = migrate_collection(
+        'recipes', 'Recipe',
+        partial(migrate_document, collection_name='recipes', url_field='image', storage_folder='recipe_images',
+                label='Recipe', pipeline=pipeline, make_variants=True),
+        pipeline, checkpoint,
+        # Let running app processes evict cached recipes with the old image URLs
+        on_page_migrated=lambda recipe_ids: publish_recipe_invalidations(db, recipe_ids))
+    logger.info(f"Recipe photo migration complete. Migrated: {migrated}, Skipped: {skipped}, Failed: {failed}")
+    return migrated, skipped, failed
+
+def migrate_review_photos(pipeline=None, checkpoint=None):
+    """Migrate review photos uploaded by users"""
+    logger.info("Starting review photo migration...")
+    pipeline = pipeline or MigrationPipeline()
+    migrated, skipped, failed = migrate_collection(
+        'reviews', 'Review',
+        partial(migrate_document, collection_name='reviews', url_field='photo_url', storage_folder='review_photos',
+                label='Review', pipeline=pipeline),
+        pipeline, checkpoint)
+    logger.info(f"Review photo migration complete. Migrated: {migrated}, Skipped: {skipped}, Failed: {failed}")
+    return migrated, skipped, failed
+
+def migrate_user_profile_photos(pipeline=None, checkpoint=None):
+    """Migrate user profile photos"""
+    logger.info("Starting user profile photo migration...")
+    pipeline = pipeline or MigrationPipeline()
+    migrated, skipped, failed = migrate_collection(
+        'users', 'User',
+        partial(migrate_document, collection_name='users', url_field='photo_url', storage_folder='profile_photos',
+                label='User', pipeline=pipeline),
+        pipeline, checkpoint)
     logger.info(f"User profile photo migration complete. Migrated: {migrated}, Skipped: {skipped}, Failed: {failed}")
     return migrated, skipped, failed
 
+def reprocess_recipe_variants(pipeline=None, checkpoint=None, force=False):
+    """Regenerate image variants for recipes whose originals are already in Firebase Storage"""
+    logger.info("Starting recipe image variant reprocessing...")
+    pipeline = pipeline or MigrationPipeline()
+    processed, skipped, failed = migrate_collection(
+        'recipes', 'Recipe', partial(reprocess_recipe_document, pipeline=pipeline, force=force),
+        pipeline, checkpoint,
+        on_page_migrated=lambda recipe_ids: publish_recipe_invalidations(db, recipe_ids))
+    logger.info(f"Image variant reprocessing complete. Processed: {processed}, Skipped: {skipped}, Failed: {failed}")
+    return processed, skipped, failed
+
+def dry_run(checkpoint):
+    """Print an estimate of the remaining migration work"""
+    estimates = [
+        ('Recipe', estimate_collection('recipes', 'image', 'Recipe', checkpoint)),
+        ('Review', estimate_collection('reviews', 'photo_url', 'Review', checkpoint)),
+        ('Profile', estimate_collection('users', 'photo_url', 'User', checkpoint))
+    ]
+    
+    print("\n======= DRY RUN ESTIMATE =======")
+    for label, (remaining_docs, remaining_photos) in estimates:
+        print(f"{label} photos: {remaining_photos} to migrate ({remaining_docs} documents left to scan)")
+    print(f"Total: {sum(photos for _, (_, photos) in estimates)} photos to migrate")
+    print("================================")
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Migrate RecipeHub photos to Firebase Storage')
+    parser.add_argument('--download-workers', type=int, default=DEFAULT_DOWNLOAD_WORKERS,
+                        help=f'Concurrent image downloads (default: {DEFAULT_DOWNLOAD_WORKERS})')
+    parser.add_argument('--upload-workers', type=int, default=DEFAULT_UPLOAD_WORKERS,
+                        help=f'Concurrent Storage uploads (default: {DEFAULT_UPLOAD_WORKERS})')
+    parser.add_argument('--update-workers', type=int, default=DEFAULT_UPDATE_WORKERS,
+                        help=f'Concurrent Firestore updates (default: {DEFAULT_UPDATE_WORKERS})')
+    parser.add_argument('--process-workers', type=int, default=DEFAULT_PROCESS_WORKERS,
+                        help=f'Concurrent image resizes (default: {DEFAULT_PROCESS_WORKERS})')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT_PATH,
+                        help=f'Checkpoint file path (default: {DEFAULT_CHECKPOINT_PATH})')
+    parser.add_argument('--hash-index', default=DEFAULT_HASH_INDEX_PATH,
+                        help=f'SQLite file of already uploaded image hashes (default: {DEFAULT_HASH_INDEX_PATH})')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue from the checkpoint file instead of starting over')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Estimate the remaining work without migrating anything')
+    return parser.parse_args()
+
 def main():
     """Run all migration functions"""
+    args = parse_args()
+    
+    # Without --resume any previous checkpoint is discarded
+    if args.resume:
+        checkpoint = MigrationCheckpoint.load(args.checkpoint)
+    else:
+        checkpoint = MigrationCheckpoint(args.checkpoint)
+    
+    if args.dry_run:
+        dry_run(checkpoint)
+        return
+    
+    hash_index = ContentHashIndex(args.hash_index, blob_exists=lambda storage_path: bucket.blob(storage_path).exists())
+    pipeline = MigrationPipeline(args.download_workers, args.upload_workers, args.update_workers,
+                                 args.process_workers, hash_index=hash_index)
     start_time = time.time()
     logger.info("Starting photo migration process...")
     
     # Migrate recipe photos
-    recipe_migrated, recipe_skipped, recipe_failed = migrate_recipe_photos()
+    recipe_migrated, recipe_skipped, recipe_failed = migrate_recipe_photos(pipeline, checkpoint)
     
     # Migrate review photos
-    review_migrated, review_skipped, review_failed = migrate_review_photos()
+    review_migrated, review_skipped, review_failed = migrate_review_photos(pipeline, checkpoint)
     
     # Migrate user profile photos
-    profile_migrated, profile_skipped, profile_failed = migrate_user_profile_photos()
+    profile_migrated, profile_skipped, profile_failed = migrate_user_profile_photos(pipeline, checkpoint)
     
     # Print summary
     total_migrated = recipe_migrated + review_migrated + profile_migrated
@@ -273,12 +741,22 @@ def main():
     logger.info(f"Total failed: {total_failed}")
     logger.info(f"Time taken: {time.time() - start_time:.2f} seconds")
     
+    stage_report = pipeline.report(time.time() - start_time)
+    for line in stage_report:
+        logger.info(f"Stage throughput - {line}")
+    dedup_report = pipeline.hash_index.report()
+    logger.info(f"Deduplication: {dedup_report}")
+    
     print("\n======= MIGRATION SUMMARY =======")
     print(f"Recipe photos: {recipe_migrated} migrated, {recipe_skipped} skipped, {recipe_failed} failed")
     print(f"Review photos: {review_migrated} migrated, {review_skipped} skipped, {review_failed} failed")
     print(f"Profile photos: {profile_migrated} migrated, {profile_skipped} skipped, {profile_failed} failed")
     print(f"Total: {total_migrated} migrated, {total_skipped} skipped, {total_failed} failed")
     print(f"Time taken: {time.time() - start_time:.2f} seconds")
+    print("Stage throughput:")
+    for line in stage_report:
+        print(f"  {line}")
+    print(f"Deduplication: {dedup_report}")
     print("=================================")
 
 if __name__ == "__main__":
@@ -0,0 +1,27 @@
+"""
+Compact recipe cards for listing pages.
+
+Listing pages only render a recipe's title, image, cook time and diet flags,
+but recipe documents also carry the summary, instructions, ingredients and
+nutrition. Each recipe therefore has a small companion document in the
+'recipe_cards' collection, written by whatever writes the recipe (the
+importers, the photo migrator), and list queries project recipes down to the
+same fields.
+"""
+
+from firebase_admin import firestore
+
+RECIPE_CARDS_COLLECTION = 'recipe_cards'
+
+# Everything a recipe card template needs
+RECIPE_CARD_FIELDS = ['id', 'title', 'image', 'image_variants', 'readyInMinutes', 'vegetarian', 'vegan',
+                      'glutenFree', 'dairyFree', 'dishTypes']
+
+def build_recipe_card(recipe):
+    """Return the card fields present in a recipe (or a partial recipe update)"""
+    card = {field: recipe[field] for field in RECIPE_CARD_FIELDS if field in recipe}
+    card['updatedAt'] = firestore.SERVER_TIMESTAMP
+    return card
+
+def recipe_card_ref(db, recipe_id):
+    return db.collection(RECIPE_CARDS_COLLECTION).document(str(recipe_id))
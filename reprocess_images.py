@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Recipe Image Reprocessing Script
+--------------------------------
+Regenerates the card and detail image variants (WebP and JPEG) for recipes
+whose original images were already migrated to Firebase Storage, e.g. after
+changing the variant sizes in image_variants.py.
+
+Usage:
+  python reprocess_images.py [--force] [--resume] [--checkpoint PATH]
+
+Options:
+  --force              Rebuild variants even for recipes that already have them
+  --resume             Continue from the checkpoint file of an interrupted run
+  --checkpoint PATH    Checkpoint file path (default: image_variants_checkpoint.json)
+"""
+
+import argparse
+import sys
+import time
+from migrate_photos import MigrationPipeline, MigrationCheckpoint, reprocess_recipe_variants
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Regenerate recipe image variants')
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild variants even for recipes that already have them')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue from the checkpoint file of an interrupted run')
+    parser.add_argument('--checkpoint', default='image_variants_checkpoint.json',
+                        help='Checkpoint file path (default: image_variants_checkpoint.json)')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    
+    if args.resume:
+        checkpoint = MigrationCheckpoint.load(args.checkpoint)
+    else:
+        checkpoint = MigrationCheckpoint(args.checkpoint)
+    
+    pipeline = MigrationPipeline()
+    start_time = time.time()
+    
+    processed, skipped, failed = reprocess_recipe_variants(pipeline, checkpoint, force=args.force)
+    
+    print(f"Recipe image variants: {processed} processed, {skipped} skipped, {failed} failed")
+    for line in pipeline.report(time.time() - start_time):
+        print(f"  {line}")
+    sys.exit(1 if failed else 0)
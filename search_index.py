@@ -0,0 +1,142 @@
+"""
+In-process inverted index for recipe search.
+
+Recipes are indexed by the words in their title, ingredient names and dish
+types. Queries match every query word either exactly or as a prefix of an
+indexed term, and results are ranked by where the words were found.
+"""
+
+import re
+import threading
+from bisect import bisect_left, insort
+
+# Weight of a match in each indexed field
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'dishTypes': 2.0,
+    'ingredients': 1.0
+}
+
+# Prefix matches count for less than whole-word matches
+PREFIX_MATCH_FACTOR = 0.5
+
+# Fields kept for each recipe so search results can be rendered as cards
+CARD_FIELDS = ('id', 'title', 'image', 'image_variants', 'readyInMinutes', 'vegetarian', 'vegan', 'glutenFree',
+               'dairyFree')
+
+STOP_WORDS = {'a', 'an', 'and', 'in', 'of', 'on', 'or', 'the', 'to', 'with'}
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+def tokenize(text):
+    """Split text into lowercase search terms"""
+    if not text:
+        return []
+    return [token for token in TOKEN_PATTERN.findall(str(text).lower()) if token not in STOP_WORDS]
+
+def recipe_terms(recipe):
+    """Return a dict of term -> weight for a recipe document"""
+    terms = {}
+
+    def add(text, weight):
+        for term in tokenize(text):
+            terms[term] = max(terms.get(term, 0), weight)
+
+    add(recipe.get('title'), FIELD_WEIGHTS['title'])
+    for dish_type in recipe.get('dishTypes') or []:
+        add(dish_type, FIELD_WEIGHTS['dishTypes'])
+    for ingredient in recipe.get('ingredients') or []:
+        if isinstance(ingredient, dict):
+            add(ingredient.get('name'), FIELD_WEIGHTS['ingredients'])
+
+    return terms
+
+class RecipeSearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}      # term -> {recipe_id: weight}
+        self._sorted_terms = []  # all terms, sorted for prefix lookups
+        self._recipe_terms = {}  # recipe_id -> set of terms, used for removal
+        self._cards = {}         # recipe_id -> card fields
+        self.ready = False
+
+    def __len__(self):
+        return len(self._cards)
+
+    def add_recipe(self, recipe):
+        """Index a recipe document, replacing any previous version"""
+        recipe_id = str(recipe.get('id', ''))
+        if not recipe_id:
+            return
+
+        terms = recipe_terms(recipe)
+        with self._lock:
+            self._remove_locked(recipe_id)
+            for term, weight in terms.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    insort(self._sorted_terms, term)
+                postings[recipe_id] = weight
+            self._recipe_terms[recipe_id] = set(terms)
+            self._cards[recipe_id] = {field: recipe.get(field) for field in CARD_FIELDS}
+            self._cards[recipe_id]['id'] = recipe_id
+
+    def remove_recipe(self, recipe_id):
+        with self._lock:
+            self._remove_locked(str(recipe_id))
+
+    def _remove_locked(self, recipe_id):
+        for term in self._recipe_terms.pop(recipe_id, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(recipe_id, None)
+            if not postings:
+                del self._postings[term]
+                del self._sorted_terms[bisect_left(self._sorted_terms, term)]
+        self._cards.pop(recipe_id, None)
+
+    def get_cards(self, recipe_ids):
+        """Return the stored card fields for the given recipe IDs, in order"""
+        with self._lock:
+            return [dict(self._cards[recipe_id]) for recipe_id in recipe_ids if recipe_id in self._cards]
+
+    def _prefix_terms(self, prefix):
+        """Return indexed terms starting with prefix"""
+        start = bisect_left(self._sorted_terms, prefix)
+        matches = []
+        for term in self._sorted_terms[start:]:
+            if not term.startswith(prefix):
+                break
+            matches.append(term)
+        return matches
+
+    def search(self, query, offset=0, limit=20):
+        """Search recipes, returning (total_matches, page_of_cards)"""
+        query_terms = list(dict.fromkeys(tokenize(query)))
+        if not query_terms:
+            return 0, []
+
+        with self._lock:
+            scores = None
+            for query_term in query_terms:
+                # Score each recipe by its best match for this query term
+                term_scores = {}
+                for term in self._prefix_terms(query_term):
+                    factor = 1.0 if term == query_term else PREFIX_MATCH_FACTOR
+                    for recipe_id, weight in self._postings[term].items():
+                        term_scores[recipe_id] = max(term_scores.get(recipe_id, 0), weight * factor)
+
+                # Every query term must match
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {recipe_id: score + term_scores[recipe_id]
+                              for recipe_id, score in scores.items() if recipe_id in term_scores}
+                if not scores:
+                    return 0, []
+
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], self._cards[item[0]].get('title') or ''))
+            page = [dict(self._cards[recipe_id], score=score) for recipe_id, score in ranked[offset:offset + limit]]
+            return len(ranked), page
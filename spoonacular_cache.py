@@ -0,0 +1,108 @@
+"""
+On-disk cache of Spoonacular API responses.
+
+Responses are stored in SQLite, keyed by a hash of the endpoint and its
+parameters (without the API key), as compressed JSON. Re-importing the same
+recipes then costs no API quota, and the importer can replay every cached
+recipe payload without touching the network.
+
+Random requests return different recipes on every call, so they are never
+served from the cache, and each response is kept under its own key instead of
+replacing the previous one.
+"""
+
+import os
+import json
+import zlib
+import time
+import sqlite3
+import uuid
+import hashlib
+import threading
+
+DEFAULT_CACHE_PATH = 'spoonacular_cache.sqlite3'
+DEFAULT_CACHE_TTL = 7 * 24 * 3600  # seconds
+
+# Parameters that don't change the response
+IGNORED_PARAMS = {'apiKey'}
+
+def cache_key(endpoint, params):
+    """Return the content address of an API request"""
+    params = {name: value for name, value in params.items() if name not in IGNORED_PARAMS}
+    request = json.dumps([endpoint, params], sort_keys=True, default=str)
+    return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+def is_random_request(endpoint, params):
+    """Return whether a request's results differ on every call"""
+    return endpoint == 'random' or params.get('sort') == 'random'
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                params TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_endpoint ON responses (endpoint, fetched_at);
+        """)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.environ.get('SPOONACULAR_CACHE_PATH', DEFAULT_CACHE_PATH),
+                   int(os.environ.get('SPOONACULAR_CACHE_TTL', DEFAULT_CACHE_TTL)))
+
+    def get(self, endpoint, params):
+        """Return the cached response for a request, or None if missing or expired"""
+        with self._lock:
+            row = self._conn.execute("SELECT payload, fetched_at FROM responses WHERE key = ?",
+                                     (cache_key(endpoint, params),)).fetchone()
+            if row is None or time.time() - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, endpoint, params, payload):
+        params = {name: value for name, value in params.items() if name not in IGNORED_PARAMS}
+        compressed = zlib.compress(json.dumps(payload).encode('utf-8'))
+        key = cache_key(endpoint, params)
+        if is_random_request(endpoint, params):
+            # Keep every random batch for replay; get() never looks these up
+            key = f"{key}:{uuid.uuid4().hex}"
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, params, payload, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (key, endpoint, json.dumps(params, sort_keys=True, default=str),
+                 compressed, time.time())
+            )
+            self._conn.commit()
+
+    def iter_payloads(self, endpoints):
+        """Yield every cached payload for the given endpoints, oldest first, ignoring the TTL"""
+        placeholders = ','.join('?' for _ in endpoints)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT endpoint, payload FROM responses WHERE endpoint IN ({placeholders}) ORDER BY fetched_at",
+                tuple(endpoints)
+            ).fetchall()
+        for endpoint, payload in rows:
+            yield endpoint, json.loads(zlib.decompress(payload))
+
+    def iter_recipes(self):
+        """Return an iterator over the latest cached full payload of every recipe"""
+        recipes = {}
+        for endpoint, payload in self.iter_payloads(('informationBulk', 'random')):
+            # /recipes/random wraps its results; informationBulk returns a plain list
+            for recipe in payload.get('recipes', []) if isinstance(payload, dict) else payload:
+                if isinstance(recipe, dict) and 'id' in recipe:
+                    recipes[str(recipe['id'])] = recipe
+        return iter(recipes.values())
@@ -0,0 +1,59 @@
+"""Build the migration's Firestore page queries against an offline client."""
+
+import os
+import importlib
+
+import pytest
+
+firebase_admin = pytest.importorskip('firebase_admin')
+pytest.importorskip('google.cloud.firestore')
+pytest.importorskip('tqdm')
+pytest.importorskip('PIL')
+
+from firebase_admin import credentials
+from google.auth.credentials import AnonymousCredentials
+
+
+class OfflineCredential(credentials.Base):
+    def get_credential(self):
+        return AnonymousCredentials()
+
+
+@pytest.fixture(scope='module')
+def migrate_photos(tmp_path_factory):
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        firebase_admin.initialize_app(OfflineCredential(), {
+            'projectId': 'recipehub-test',
+            'storageBucket': 'recipehub-test.appspot.com'
+        })
+    # The module sets up its log file in the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('migration'))
+    try:
+        yield importlib.import_module('migrate_photos')
+    finally:
+        os.chdir(cwd)
+
+
+def test_page_query_orders_by_document_id(migrate_photos):
+    collection = migrate_photos.db.collection('recipes')
+    query = migrate_photos.page_query(collection)._to_protobuf()
+    assert query.order_by[0].field.field_path == '__name__'
+    assert query.limit.value == migrate_photos.PAGE_SIZE
+
+
+def test_page_query_resumes_after_document(migrate_photos):
+    collection = migrate_photos.db.collection('recipes')
+    query = migrate_photos.page_query(collection, 'abc', field_paths=['image'])._to_protobuf()
+    assert query.start_at.values[0].reference_value.endswith('/recipes/abc')
+    assert not query.start_at.before
+    assert [field.field_path for field in query.select.fields] == ['image']
+
+
+def test_remaining_query_filters_on_document_id(migrate_photos):
+    collection = migrate_photos.db.collection('recipes')
+    query = migrate_photos.remaining_query(collection, 'abc')
+    assert query._nested_query._to_protobuf().where.field_filter.field.field_path == '__name__'
+    migrate_photos.remaining_query(collection)._to_protobuf()